@@ -1,25 +1,56 @@
 import time
 import queue
-import threading
+import concurrent.futures
 import os
 import traceback
-import re
 import mimetypes
+import heapq
 
 import sublime_plugin
 import sublime
 
 from . import filesearcher
 from . import resultbuffer
-from . import tfidf_search
 from . import pagerank
+from . import indexservice
+from . import workerclient
+from . import searchsession
 from . import scanners
 
-# Split terms by non-word characters
-DEFAULT_TERM_SEPARATOR_PATTERN = r'\W+'
+# Rank component used in run_search
+RANK_MODE_GLOBAL = pagerank.RANK_MODE_GLOBAL
+RANK_MODE_PERSONALIZED = pagerank.RANK_MODE_PERSONALIZED
 
-#  Page references are any word characters surrounded by double square brackets
-DEFAULT_PAGE_REF_PATTERN = r'(?:\[\[)(\w+)(?:\]\])'
+# Share of the search time limit that scoring and ranking may use up to. Both
+# stages end at a fixed point of the budget so the files are always left the
+# rest, plus time saved by the earlier stages.
+SCORING_BUDGET_SHARE = 0.4
+RANKING_BUDGET_SHARE = 0.6
+
+# Term suggestions are looked up on their own thread. The Sublime async thread
+# is held by the result display of a running search.
+_suggestion_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+
+def print_exception(future):
+    """Print the exception of a background task, which would otherwise be lost"""
+    if future.exception() is not None:
+        traceback.print_exception(type(future.exception()), future.exception(), future.exception().__traceback__)
+
+
+def plugin_loaded():
+    """Start warming the indexes of the open projects"""
+    service = indexservice.get_service()
+    for win in sublime.windows():
+        if win.folders():
+            service.acquire(win)
+
+
+def plugin_unloaded():
+    indexservice.get_service().shutdown()
+    searchsession.shutdown()
+    workerclient.shutdown()
+    _suggestion_executor.shutdown(wait=False)
 
 
 class FindInProject(sublime_plugin.WindowCommand):
@@ -33,75 +64,63 @@ class FindInProject(sublime_plugin.WindowCommand):
         sublime_plugin.TextCommand.__init__(self, view)
         settings = sublime.load_settings('FindInProject.sublime-settings')
         self.excessive_hits_count = settings.get('find_in_project_excessive_hits_count', 5000)
-
-        page_ref_pattern = settings.get("find_in_project_page_ref_pattern", DEFAULT_PAGE_REF_PATTERN)
-        self.page_ref_matcher = re.compile(page_ref_pattern, re.UNICODE)
-
-        term_separator_pattern = settings.get("find_in_project_term_separator_pattern", DEFAULT_TERM_SEPARATOR_PATTERN)
-        self.term_splitter = re.compile(term_separator_pattern, re.UNICODE)
-
-        self.search_dirs = self.list_search_dirs()
-        self.file_scanner = scanners.FileScanner(settings)
-        self.dir_scanner = scanners.DirScanner(settings)
+        self.search_timeout_ms = settings.get('find_in_project_search_timeout_ms', 0)
+        self.rank_mode = settings.get('find_in_project_rank_mode', RANK_MODE_GLOBAL)
+        self.personalized_seed_count = settings.get('find_in_project_personalized_seed_count', 20)
+        self.suggestion_count = settings.get('find_in_project_suggestion_count', 8)
+        self.suggestion_max_edit_distance = settings.get('find_in_project_suggestion_max_edit_distance', 1)
+        self.suggestion_text = None
+        self.search_workers = settings.get('find_in_project_search_workers', 2)
 
     def run(self):
         """Show search panel"""
 
         print("Running document search...")
 
-        # Update list of search directories
-        self.search_dirs = self.list_search_dirs()
-        self.start_scan()
+        # Get the shared index for the project folders and bring it up to date
+        # in the background. Searches use the current index meanwhile.
+        win = sublime.active_window()
+        self.project_index = indexservice.get_service().acquire(win)
+        if self.project_index.is_ready():
+            self.project_index.refresh()
 
         # Initial search to selection...
         search_text = self.prepare_search_text()
 
         # Search panel
-        win = sublime.active_window()
-        win.show_input_panel("Search in documents:", search_text, self.run_search, None, None)
+        win.show_input_panel("Search in documents:", search_text, self.run_search, self.on_search_change, None)
 
-    def start_scan(self):
-        """Start the document scan in the background"""
+    def on_search_change(self, search_text):
+        """Suggest completions for the term being typed"""
 
-        self.scanning_thread = threading.Thread(target=self.scan_project, args=())
-        self.scanning_thread.start()
-
-    def scan_project(self):
-        """Scan the documents"""
-
-        self._idf_table = tfidf_search.TfIdfTable()
-        self._graph = pagerank.Graph()
-
-        for folder in self.search_dirs:
-            print("Scanning directory:", folder)
-            for dirname, _, files in self.dir_scanner.list_tree(folder):
-                for file in files:
-                    self.scan_file(dirname, file)
-
-        print("Scanned", len(self._idf_table), "documents")
+        if self.suggestion_count == 0:
+            return
 
-    def scan_file(self, dirname, file):
-        filename = os.path.join(dirname, file)
-        pagename = os.path.splitext(file)[0]
+        # Look up in the background - only the latest text is answered
+        self.suggestion_text = search_text
+        future = _suggestion_executor.submit(self.show_suggestions, search_text)
+        future.add_done_callback(print_exception)
 
-        terms = []
-        page_refs = []
-        for line_no, line in self.file_scanner.read_lines(filename):
-            terms.extend(self._extract_terms(line))
-            page_refs.extend(self._extract_page_refs(line))
+    def show_suggestions(self, search_text):
+        """Show completions and close misspellings of the last term in the status bar"""
 
-        # Append to IDF
-        self._idf_table.append_document(filename, terms)
+        if search_text != self.suggestion_text:
+            return
 
-        # Append to PageRank
-        node = self._graph.add_node_with_refs(pagename, *page_refs)
-        node.filename = filename
+        term_dictionary = self.project_index.term_dictionary()
+        if term_dictionary is None or not search_text or search_text[-1].isspace():
+            return
 
-    def _extract_terms(self, line):
-        return [x.lower() for x in self.term_splitter.split(line) if x != '']
+        term = search_text.split()[-1].lower()
+        suggestions = term_dictionary.suggest(term, self.suggestion_max_edit_distance, self.suggestion_count)
+        if search_text != self.suggestion_text:
+            return
 
-    def _extract_page_refs(self, line):
-        return self.page_ref_matcher.findall(line)
+        win = sublime.active_window()
+        if suggestions:
+            win.status_message("FindInProject: " + "  ".join("%s (%i)" % suggestion for suggestion in suggestions))
+        else:
+            win.status_message("FindInProject: No terms matching '%s'" % term)
 
     def prepare_search_text(self):
         """Prepare the initial search text"""
@@ -128,8 +147,13 @@ class FindInProject(sublime_plugin.WindowCommand):
         if len(search_text) == 0:
             return
 
-        # Wait for scan to complete
-        self.scanning_thread.join()
+        # Wait for the first scan to complete
+        snapshot = self.project_index.snapshot()
+        if snapshot is None:
+            sublime.active_window().status_message(
+                "FindInProject: Index unavailable (the project scan failed, see the console)")
+            return
+        idf_table, graph, global_ranks = snapshot
 
         print("Searching for:", search_text)
         self.search_text = search_text
@@ -138,135 +162,218 @@ class FindInProject(sublime_plugin.WindowCommand):
         win = sublime.active_window()
         view = win.active_view()
 
-        # Init member vars for new search
-        self.result_queue = queue.Queue()
-        self.num_hits = 0
-        self.num_file_hits = 0
-        self.last_status_update = 0
-        self.search_cancelled = False
-        self.files_searched = 0
-        self.search_start_time = time.time()
+        # Start a new search session - this supersedes any search still
+        # running in the window
+        session_manager = searchsession.get_manager(self.search_workers)
+        session = session_manager.begin(win.id())
+        if self.search_timeout_ms:
+            search_budget = self.search_timeout_ms / 1000.0
+            scoring_deadline = session.search_start_time + SCORING_BUDGET_SHARE * search_budget
+            ranking_deadline = session.search_start_time + RANKING_BUDGET_SHARE * search_budget
+            search_deadline = session.search_start_time + search_budget
+        else:
+            scoring_deadline = ranking_deadline = search_deadline = None
 
         # Initialize result buffer/view
-        self.result_buffer = resultbuffer.ResultBuffer(win, search_text)
+        session.result_buffer = resultbuffer.ResultBuffer(win, search_text)
 
         # Calculate term scores
-        term_scores = self._idf_table.search(search_text)
+        term_scores = idf_table.search(search_text, deadline=scoring_deadline)
+        session.index_coverage = idf_table.last_coverage
+        if session.index_coverage < 1.0:
+            session.search_partial = True
         sum_scores = sum(score for _, score in term_scores)
         # print('sum_scores:', sum_scores, 'term_scores:', term_scores)
 
-        # Calculate rank scores
-        page_rank = pagerank.PageRank(self._graph)
-        rank_scores, iteration_count = page_rank.calculate()
-
-        # Prepare mapping of matched filenames to rank value
-        sum_ranks = 0.0
-        rank_mappings = {}
-        missing_pages = []
-        for pagename, rank in rank_scores:
-            node = self._graph.get_node_by_id(pagename)
-            if hasattr(node, 'filename'):
-                sum_ranks += rank
-                rank_mappings[node.filename] = rank
-            else:
-                missing_pages.append(pagename)
-
-        if missing_pages:
-            print("Missing pages: ", missing_pages)
+        # Calculate rank scores as a mapping of matched filenames to rank value
+        file_ranks, session.rank_timed_out = self.calculate_rank_scores(graph, global_ranks, term_scores,
+                                                                        ranking_deadline)
+        if session.rank_timed_out:
+            session.search_partial = True
+        rank_mappings, sum_ranks = file_ranks
+        personalized = self.rank_mode == RANK_MODE_PERSONALIZED
 
         # Prepare list of files with match value = weighted average of score and rank
         scores_weight = 1.0/2.0*sum_scores
         ranks_weight = 1.0/2.0*sum_ranks
-        match_scores = list((filename, scores_weight*score + ranks_weight*rank_mappings[filename])
+        # Personalised ranks only cover the neighbourhood of the seeds - other
+        # pages have a negligible rank
+        match_scores = list((filename, scores_weight*score + ranks_weight*rank_mappings.get(filename, 0.0))
                             for filename, score in term_scores
-                            if filename in rank_mappings)
+                            if personalized or filename in rank_mappings)
 
         match_scores.sort(reverse=True, key=lambda x: x[1])
         matching_files = list(match[0] for match in match_scores)
+        session.files_to_search = len(matching_files)
 
-        self.search_thread = filesearcher.FileSearcherThread(matching_files, search_text, self.result_queue)
-        self.search_thread.start()
+        searcher = filesearcher.FileSearcher(matching_files, search_text, session.result_queue, search_deadline)
+        session_manager.run(session, searcher)
 
         # Display results asynchronously
-        sublime.set_timeout_async(self.display_search_results, 1)
+        sublime.set_timeout_async(lambda: self.display_search_results(win.id(), session), 1)
 
-    def list_search_dirs(self):
-        """Add all project dirs"""
+    def calculate_rank_scores(self, graph, global_ranks, term_scores, deadline=None):
+        """
+        Rank the pages, either globally or biased towards the best term matches.
+        Global ranks are query independent and come with the index snapshot.
+        Returns (({filename: rank}, sum of ranks), whether the deadline stopped
+        the ranking).
+        """
+        if self.rank_mode != RANK_MODE_PERSONALIZED and global_ranks is not None:
+            return global_ranks, False
+
+        if self.rank_mode == RANK_MODE_PERSONALIZED:
+            # Seed from the top term matches weighted by their scores
+            seeds = {}
+            for filename, score in heapq.nlargest(self.personalized_seed_count, term_scores, key=lambda x: x[1]):
+                pagename = os.path.splitext(os.path.basename(filename))[0]
+                seeds[pagename] = seeds.get(pagename, 0.0) + score
+
+            page_rank = pagerank.PersonalizedPageRank(graph)
+            rank_scores, push_count = page_rank.calculate(seeds, deadline=deadline)
+        else:
+            page_rank = pagerank.PageRank(graph)
+            rank_scores, iteration_count = page_rank.calculate(deadline=deadline)
 
-        search_dirs = []
+        return pagerank.file_ranks(graph, rank_scores), page_rank.timed_out
 
-        win = sublime.active_window()
-        for folder in win.folders():
-            search_dirs.append(folder)
+    def display_search_results(self, window_id, session):
+        """Handle search results that the searcher places on the session result queue"""
 
-        return search_dirs
+        while session.is_running() or session.has_results():
+            # A newer search took over - its session drains our results
+            if session.is_superseded():
+                return
 
-    def display_search_results(self):
-        """Handle search results that the search thread places on the result queue"""
-        
-        while self.search_thread.isAlive() or (self.result_queue.empty() == False):
-            self.update_status()
+            self.update_status(session)
 
             # Check if result buffer has been closed - in this case we cancel the
             # search.
-            if self.result_buffer.is_closed():
-                self.search_thread.stop()
-                self.search_cancelled = True
+            if session.result_buffer.is_closed():
+                session.stop()
+                session.search_cancelled = True
                 break
 
-            # If there are any results
-            if not self.result_queue.empty():
-                result = self.result_queue.get()
-
-                # Update number of hits but ensure it does not include warning/error strings
-                if "result" in result and len(result["result"]):
-                    if 0 not in result["result"]:
-                        self.num_hits = self.num_hits + len(result["result"])
-                        self.num_file_hits = self.num_file_hits + 1
-
-                # Update number of files searched
-                if "files_searched" in result:
-                    self.files_searched = result["files_searched"]
-
-                # If we reach excessive limit start dropping results and stop search thread
-                if (self.excessive_hits_count != 0) and (self.num_hits > self.excessive_hits_count):
-                    self.search_thread.stop()
-                    self.search_cancelled = True
-                    break
+            # Wait briefly for results
+            try:
+                result = session.result_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # Update number of hits but ensure it does not include warning/error strings
+            if "result" in result and len(result["result"]):
+                if 0 not in result["result"]:
+                    session.num_hits = session.num_hits + len(result["result"])
+                    session.num_file_hits = session.num_file_hits + 1
+
+            # Update number of files searched
+            if "files_searched" in result:
+                session.files_searched = result["files_searched"]
+            if "cache_hits" in result:
+                session.cache_hits = result["cache_hits"]
+
+            # Searcher stopped at the deadline - keep what we have
+            if "timed_out" in result:
+                session.search_partial = True
+
+            # If we reach excessive limit start dropping results and stop the searcher. Files are
+            # searched in rank order so the results shown so far are the best ranked ones.
+            if (self.excessive_hits_count != 0) and (session.num_hits > self.excessive_hits_count):
+                session.stop()
+                session.search_partial = True
+                break
 
-                # Update result view
-                if "result" in result:
-                    self.result_buffer.insert_result(result)
+            # Update result view
+            if "result" in result:
+                session.result_buffer.insert_result(result)
 
-                self.result_queue.task_done()
+            session.result_queue.task_done()
 
-        # We are done searching
-        self.set_final_status()
+        # We are done searching - drop anything left behind by a stopped searcher
+        session.drain()
+        searchsession.get_manager().end(window_id, session)
+        self.set_final_status(session)
 
-    def update_status(self):
+    def update_status(self, session):
         """
         Update text in status bar
         """
         cur_time = time.time()
-        if cur_time > (self.last_status_update + 0.2):
-            self.last_status_update = cur_time
-            cur_search_time = cur_time - self.search_start_time
+        if cur_time > (session.last_status_update + 0.2):
+            session.last_status_update = cur_time
+            cur_search_time = cur_time - session.search_start_time
             win = sublime.active_window()
             status_msg = "FindInProject: Searching project"
-            status_msg += " [%i hits across %i files so far]" % (self.num_hits, self.num_file_hits)
-            status_msg += " [%i files searched in %.1f seconds]" % (self.files_searched, cur_search_time)
+            status_msg += " [%i hits across %i files so far]" % (session.num_hits, session.num_file_hits)
+            status_msg += " [%i files searched in %.1f seconds]" % (session.files_searched, cur_search_time)
             win.status_message(status_msg)
 
-    def set_final_status(self):
+    def set_final_status(self, session):
         """
         Set final text in status bar
         """
         win = sublime.active_window()
-        if self.search_cancelled:
-            win.status_message("FindInProject: Search cancelled (due to close or excessive number of hits)")
+        if session.search_cancelled:
+            win.status_message("FindInProject: Search cancelled (due to closed result view)")
         else:
-            cur_search_time = time.time() - self.search_start_time
-            status_msg = "FindInProject: Search finished"
-            status_msg += " [%i hits across %i files]" % (self.num_hits, self.num_file_hits)
-            status_msg += " [%i files searched in %.1f seconds]" % (self.files_searched, cur_search_time)
+            cur_search_time = time.time() - session.search_start_time
+            if session.search_partial:
+                status_msg = "FindInProject: Search stopped (due to time limit or excessive number of hits)"
+            else:
+                status_msg = "FindInProject: Search finished"
+            status_msg += " [%i hits across %i files]" % (session.num_hits, session.num_file_hits)
+            status_msg += " [%i files searched in %.1f seconds]" % (session.files_searched, cur_search_time)
+            line_cache = scanners.get_line_cache(sublime.load_settings('FindInProject.sublime-settings'))
+            if line_cache is not None and session.files_searched:
+                status_msg += " [%.0f%% read from cache]" % (100.0 * session.cache_hits / session.files_searched)
+            if session.search_partial:
+                status_msg += " [%s]" % self.coverage_description(session)
             win.status_message(status_msg)
+
+    def coverage_description(self, session):
+        """
+        Describe how much of the corpus a partial search covered
+        """
+        if session.files_to_search:
+            file_coverage = session.files_searched / float(session.files_to_search)
+        else:
+            file_coverage = 1.0
+
+        description = "%.0f%% of index scored, %.0f%% of %i matching files searched" % \
+                      (100.0 * session.index_coverage, 100.0 * file_coverage, session.files_to_search)
+        if session.rank_timed_out:
+            description += ", ranks approximate"
+
+        return description
+
+
+class FindInProjectIndexStats(sublime_plugin.WindowCommand):
+    """Show the memory used by the index of the project"""
+
+    def run(self):
+        win = self.window
+        project_index = indexservice.get_service().acquire(win)
+        if not project_index.is_ready():
+            win.status_message("FindInProject: Index is still being scanned")
+            return
+        if project_index.snapshot() is None:
+            win.status_message("FindInProject: Index unavailable (the project scan failed, see the console)")
+            return
+
+        memory_usage, mapped_size = project_index.memory_report()
+        total = sum(size for _, size in memory_usage)
+        status_msg = "FindInProject: Index memory %s" % indexservice.format_size(total)
+        if project_index.memory_budget_mb:
+            status_msg += " of %i MB budget" % project_index.memory_budget_mb
+        for name, size in memory_usage:
+            status_msg += " [%s %s]" % (name, indexservice.format_size(size))
+        if mapped_size:
+            status_msg += " [mapped index file %s]" % indexservice.format_size(mapped_size)
+
+        line_cache = scanners.get_line_cache(sublime.load_settings('FindInProject.sublime-settings'))
+        if line_cache is not None and line_cache.hits + line_cache.misses:
+            status_msg += " [line cache %s, %.0f%% hit rate]" % (indexservice.format_size(line_cache.size),
+                                                                  100.0 * line_cache.hit_rate())
+
+        print(status_msg)
+        win.status_message(status_msg)
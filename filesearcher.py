@@ -1,67 +1,135 @@
-import os
 import threading
-import collections
 import time
+import collections
+import queue
 
 import sublime
 
 from . import scanners
+from . import workerclient
 
 
-class FileSearcherThread(threading.Thread):
+class FileSearcher:
     """
-    Search directories recursively in separate thread and push results onto a
-    queue.
+    Search the matching files and push results onto a queue. Run on a thread
+    of the shared search pool.
     """
-    def __init__(self, matching_files, target_string, result_queue):
-        super().__init__()
+    def __init__(self, matching_files, target_string, result_queue, deadline=None):
         self._stop_thread = threading.Event()
         self._matching_files = matching_files
-        self._search_terms = [x.lower() for x in target_string.split()]
 
         self._result_queue = result_queue
         self._files_searched = 0
         self._files_searched_last_update = 0
+        self._cache_hits = 0
+        self._deadline = deadline
 
         settings = sublime.load_settings('FindInProject.sublime-settings')
-        self.max_line_len = settings.get('find_in_project_max_line_len', 100)
-
-        self.scanner = scanners.FileScanner(settings)
+        self.settings = settings
+        self.target_string = target_string
+        self.matcher = scanners.FileMatcher(settings, target_string)
 
     def stop(self):
         """
-        Stop the thread after it is done searching the current file.
+        Stop the search after it is done searching the current file.
         """
         self._stop_thread.set()
 
     def run(self):
         """
-        Override the run method from threading.Thread to do a search when the
-        thread is started. This should not be called directly obviously.
+        Do the search. Returns when all files are searched or a stop has been
+        requested - the result queue is left for the session to drain.
+        """
+        client = workerclient.get_client()
+        if client is None or not self._search_in_worker(client):
+            self._search_files()
+
+        if self._stop_requested():
+            return
+
+        # Send a final update on files searched
+        update = {"files_searched": self._files_searched, "cache_hits": self._cache_hits}
+        self._result_queue.put(update)
+
+    def _search_files(self):
+        """
+        Search the files in this thread.
         """
         for filepath in self._matching_files:
             if self._stop_requested():
                 return
 
-            result = self._search_file(filepath)
+            # Files are searched in rank order so stopping at the deadline
+            # keeps the best results found so far. The top ranked file is
+            # always searched.
+            if self._deadline is not None and self._files_searched and time.time() > self._deadline:
+                update = {"files_searched": self._files_searched, "timed_out": True}
+                self._result_queue.put(update)
+                break
+
+            result = self.matcher.search_file(filepath)
             self._files_searched = self._files_searched + 1
+            self._cache_hits = self.matcher.scanner.cache_hits
 
             if len(result):
-                ret = {"filepath": filepath, "result": result, "files_searched": self._files_searched}
+                ret = {"filepath": filepath, "result": result, "files_searched": self._files_searched,
+                       "cache_hits": self._cache_hits}
                 self._result_queue.put(ret)
                 self._files_searched_last_update = time.time()
             elif time.time() > (self._files_searched_last_update + 0.2):
-                update = {"files_searched": self._files_searched}
+                update = {"files_searched": self._files_searched, "cache_hits": self._cache_hits}
                 self._result_queue.put(update)
                 self._files_searched_last_update = time.time()
 
+    def _search_in_worker(self, client):
+        """
+        Search the files in the worker process and forward the result batches.
+        Returns False if the worker failed before sending any results.
+        """
+        try:
+            request_id, reply_queue = client.request({
+                "command": "search",
+                "files": self._matching_files,
+                "target_string": self.target_string,
+                "settings": workerclient.worker_settings(self.settings),
+                "deadline": self._deadline
+            })
+        except OSError as e:
+            print("Worker search failed, searching in plugin host:", e)
+            return False
+
+        while True:
+            if self._stop_requested():
+                client.cancel(request_id)
+                return True
+
+            try:
+                reply = reply_queue.get(timeout=0.1)
+            except queue.Empty:
+                if client.is_alive() or not reply_queue.empty():
+                    continue
+                reply = {"id": request_id, "error": "Worker process exited"}
+
+            if "error" in reply:
+                print("Worker search failed:", reply["error"])
+                client.finish(request_id)
+                return self._files_searched > 0
+
+            self._files_searched = reply["files_searched"]
+            self._cache_hits = reply.get("cache_hits", 0)
+            for filepath, lines in reply["results"]:
+                ret = {"filepath": filepath, "result": collections.OrderedDict(lines),
+                       "files_searched": self._files_searched, "cache_hits": self._cache_hits}
+                self._result_queue.put(ret)
 
-        # Send a final update on files searched
-        update = {"files_searched": self._files_searched}
-        self._result_queue.put(update)
+            if reply.get("timed_out"):
+                self._result_queue.put({"files_searched": self._files_searched, "timed_out": True})
+            elif not reply["results"]:
+                self._result_queue.put({"files_searched": self._files_searched, "cache_hits": self._cache_hits})
 
-        # Wait until all results have been read from the queue - then terminate
-        self._result_queue.join()
+            if reply.get("done"):
+                client.finish(request_id)
+                return True
 
     def _stop_requested(self):
         """
@@ -69,53 +137,3 @@ class FileSearcherThread(threading.Thread):
         """
         flag = self._stop_thread.wait(0)
         return flag
-
-    def _search_file(self, path):
-        """Search a file for the search terms."""
-
-        ret = collections.OrderedDict()
-        for line_num, line_content in self.scanner.read_lines(path):
-            # Search line for target string
-            loc = self._line_matches(line_content, self._search_terms)
-            if loc >= 0:
-                if len(line_content) > self.max_line_len:
-                    line_content = self._limit_line(line_content, loc)
-                ret[line_num] = line_content
-
-        if self.scanner.warnings:
-            ret[0] = self.scanner.warnings[0]
-
-        return ret
-
-    def _line_matches(self, line, terms):
-        lower_line = line.lower()
-        for term in terms:
-            location = lower_line.find(term)
-            if location >= 0:
-                return location
-
-        return -1
-
-    def _limit_line(self, line, loc):
-        """
-        Limit the provided line according to the settings.
-        """
-        single_side_len = int(self.max_line_len/2)
-
-        start = loc - single_side_len
-        if start < 0:
-            start = 0
-
-        end = loc + single_side_len
-        if (end >= len(line)):
-            end = len(line)-1
-
-        limited_line = ""
-        if start != 0:
-            limited_line = limited_line + "[…]"
-
-        limited_line = limited_line + line[start:end]
-        if end != len(line)-1:
-            limited_line = limited_line + "[…]"
-
-        return limited_line
@@ -0,0 +1,74 @@
+import os
+import re
+
+from . import pagerank
+from . import scanners
+from . import tfidf_search
+
+# Split terms by non-word characters
+DEFAULT_TERM_SEPARATOR_PATTERN = r'\W+'
+
+#  Page references are any word characters surrounded by double square brackets
+DEFAULT_PAGE_REF_PATTERN = r'(?:\[\[)(\w+)(?:\]\])'
+
+
+class ProjectIndexer:
+    """Scan project folders into a TfIdfTable and a link Graph.
+
+    Independent of the editor so it can also run in the worker process.
+    """
+
+    def __init__(self, settings):
+        page_ref_pattern = settings.get("find_in_project_page_ref_pattern", DEFAULT_PAGE_REF_PATTERN)
+        self.page_ref_matcher = re.compile(page_ref_pattern, re.UNICODE)
+
+        term_separator_pattern = settings.get("find_in_project_term_separator_pattern", DEFAULT_TERM_SEPARATOR_PATTERN)
+        self.term_splitter = re.compile(term_separator_pattern, re.UNICODE)
+
+        self.file_scanner = scanners.FileScanner(settings)
+        self.dir_scanner = scanners.DirScanner(settings)
+
+    def scan(self, folders):
+        """Scan the documents in folders and return (table, finalized graph)"""
+
+        idf_table = tfidf_search.TfIdfTable()
+        graph = pagerank.Graph()
+
+        for folder in folders:
+            print("Scanning directory:", folder)
+            for dirname, _, files in self.dir_scanner.list_tree(folder):
+                for file in files:
+                    self.scan_file(idf_table, graph, dirname, file)
+
+        print("Scanned", len(idf_table), "documents")
+        graph.finalize()
+
+        return idf_table, graph
+
+    def scan_file(self, idf_table, graph, dirname, file):
+        filename = os.path.join(dirname, file)
+        pagename = os.path.splitext(file)[0]
+
+        # Stream terms straight into running counts so memory is bounded by
+        # the document vocabulary rather than the file size
+        term_counts = {}
+        term_total = 0
+        page_refs = []
+        for line_no, line in self.file_scanner.read_lines(filename):
+            for term in self._extract_terms(line):
+                term_counts[term] = term_counts.get(term, 0.0) + 1.0
+                term_total += 1
+            page_refs.extend(self._extract_page_refs(line))
+
+        # Append to IDF
+        idf_table.append_document_counts(filename, term_counts, term_total)
+
+        # Append to PageRank
+        node = graph.add_node_with_refs(pagename, *page_refs)
+        node.filename = filename
+
+    def _extract_terms(self, line):
+        return (x for x in self.term_splitter.split(line.lower()) if x != '')
+
+    def _extract_page_refs(self, line):
+        return self.page_ref_matcher.findall(line)
@@ -0,0 +1,445 @@
+import hashlib
+import os
+import threading
+import traceback
+
+import sublime
+
+from . import indexer
+from . import matrix_search
+from . import pagerank
+from . import postings
+from . import termdict
+from . import workerclient
+
+MEGABYTE = 1024 * 1024
+
+
+def format_size(size):
+    return "%.1f MB" % (size / float(MEGABYTE))
+
+
+def search_table_name(search_table):
+    """Name of a search table in memory reports"""
+    if isinstance(search_table, postings.MappedTfIdfTable):
+        return "mapped index"
+    if matrix_search.is_available() and isinstance(search_table, matrix_search.MatrixSearchTable):
+        return "matrix"
+    return "tf-idf table"
+
+
+class ProjectIndex:
+    """Search index for a set of project folders.
+
+    * Scans the folders in the background
+    * Readers get a consistent (table, graph) snapshot while a rescan builds
+      the next one
+    """
+
+    def __init__(self, folders):
+        self.folders = folders
+        self.ref_count = 0
+
+        settings = sublime.load_settings('FindInProject.sublime-settings')
+        self.settings = settings
+
+        self.persist_index = settings.get("find_in_project_persist_index", True)
+        self.scoring = str(settings.get("find_in_project_scoring", matrix_search.SCORING_TFIDF)).lower()
+        if self.scoring not in matrix_search.SCORING_MODES:
+            print("Unknown scoring mode", self.scoring, "- using", matrix_search.SCORING_TFIDF, "scoring")
+            self.scoring = matrix_search.SCORING_TFIDF
+        self.vectorized_scoring = settings.get("find_in_project_vectorized_scoring", True)
+        self.memory_budget_mb = settings.get("find_in_project_memory_budget_mb", 0)
+        self.rank_mode = settings.get("find_in_project_rank_mode", pagerank.RANK_MODE_GLOBAL)
+
+        self.indexer = indexer.ProjectIndexer(settings)
+
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._idf_table = None
+        self._graph = None
+        self._global_ranks = None
+        self._term_dictionary = None
+        self._memory_usage = []
+        self._mapped_size = 0
+        self._scanning_thread = None
+        self._rescan_requested = False
+
+    def refresh(self):
+        """Rescan the folders in the background.
+
+        If a scan is already running another one is queued to start when it
+        completes, so changes made meanwhile are not missed.
+        """
+        with self._lock:
+            if self._scanning_thread is not None and self._scanning_thread.is_alive():
+                self._rescan_requested = True
+                return
+
+            self._scanning_thread = threading.Thread(target=self._scan_loop, args=())
+            self._scanning_thread.daemon = True
+            self._scanning_thread.start()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def snapshot(self):
+        """Return the current (table, graph, global ranks), waiting for the first scan.
+
+        The global ranks are ({filename: rank}, sum of ranks) when the rank
+        mode is global, otherwise None. Returns None if the first scan
+        failed - the next refresh retries it.
+        """
+        self._ready.wait()
+        with self._lock:
+            if self._idf_table is None:
+                return None
+            return self._idf_table, self._graph, self._global_ranks
+
+    def term_dictionary(self):
+        """Return the current term dictionary without waiting, None until the first scan."""
+        with self._lock:
+            return self._term_dictionary
+
+    def memory_report(self):
+        """Return ([(component, bytes)], mapped index bytes) for the current snapshot"""
+        with self._lock:
+            return list(self._memory_usage), self._mapped_size
+
+    def _scan_loop(self):
+        if self.persist_index and not self.is_ready():
+            try:
+                self.load_stored_index()
+            except Exception:
+                # The scan below still publishes a snapshot or releases the
+                # waiting searches
+                traceback.print_exc()
+                print("Loading the stored index of", self.folders, "failed")
+
+        while True:
+            try:
+                self.scan_project()
+            except Exception:
+                traceback.print_exc()
+                print("Scan of", self.folders, "failed")
+
+                # Release searches waiting for the first scan, they find no
+                # snapshot and report the index as unavailable
+                self._ready.set()
+
+            with self._lock:
+                if not self._rescan_requested:
+                    self._scanning_thread = None
+                    return
+                self._rescan_requested = False
+
+    def scan_project(self):
+        """Scan the documents and publish them as the new snapshot"""
+
+        client = workerclient.get_client()
+        if client is not None and self.scan_in_worker(client):
+            return
+
+        idf_table, graph = self.indexer.scan(self.folders)
+        idf_table.scoring = self.scoring
+        term_dictionary = termdict.TermDictionary(idf_table.document_frequencies())
+
+        mapped_table = None
+        if self.persist_index:
+            mapped_table = self.store_index(idf_table, graph)
+
+        search_table = idf_table if mapped_table is None else mapped_table
+        if self.vectorized_scoring and matrix_search.is_available():
+            search_table = matrix_search.MatrixSearchTable(idf_table, self.scoring)
+
+        self.publish(search_table, graph, term_dictionary, idf_table, mapped_table)
+
+    def scan_in_worker(self, client):
+        """Scan the documents in the worker process and publish the index it stored"""
+
+        try:
+            index_path, graph_path = self.new_index_paths()
+        except OSError:
+            traceback.print_exc()
+            return False
+
+        try:
+            request_id, reply_queue = client.request({
+                "command": "scan",
+                "folders": list(self.folders),
+                "settings": workerclient.worker_settings(self.settings),
+                "index_path": index_path,
+                "graph_path": graph_path
+            })
+        except OSError as e:
+            print("Worker scan failed, scanning in plugin host:", e)
+            return False
+
+        reply = client.wait_reply(request_id, reply_queue)
+        client.finish(request_id)
+
+        if "error" in reply:
+            print("Worker scan failed, scanning in plugin host:", reply["error"])
+            return False
+
+        print("Worker scanned", reply["documents"], "documents")
+        return self.load_stored_index()
+
+    def load_stored_index(self):
+        """Publish the stored index and graph, returns False if they cannot be loaded"""
+
+        generations = self.stored_generations()
+        if not generations:
+            return False
+
+        index_path, graph_path = self.index_paths(generations[-1])
+
+        try:
+            idf_table = postings.MappedTfIdfTable(index_path, self.scoring)
+            graph = pagerank.Graph.load(graph_path)
+        except (OSError, ValueError):
+            traceback.print_exc()
+            return False
+
+        term_dictionary = termdict.TermDictionary(idf_table.document_frequencies())
+
+        print("Loaded stored index:", index_path)
+        self.publish(idf_table, graph, term_dictionary)
+
+        return True
+
+    def publish(self, search_table, graph, term_dictionary, idf_table=None, mapped_table=None):
+        """Fit the index into the memory budget and publish it as the new snapshot"""
+
+        search_table, term_dictionary, memory_usage = \
+            self.fit_memory_budget(search_table, graph, term_dictionary, idf_table, mapped_table)
+
+        mapped_size = 0
+        if isinstance(search_table, postings.MappedTfIdfTable):
+            mapped_size = search_table.mapped_size()
+
+        # Global ranks do not depend on the search - calculate them once here
+        # rather than on every search
+        global_ranks = None
+        if self.rank_mode == pagerank.RANK_MODE_GLOBAL:
+            global_ranks = ({}, 0.0)
+            if len(graph):
+                page_ranks, iteration_count = pagerank.PageRank(graph).calculate()
+                print("Calculated global page ranks in", iteration_count, "iterations")
+                global_ranks = pagerank.file_ranks(graph, page_ranks)
+
+        print("Index memory:", ", ".join("%s %s" % (name, format_size(size)) for name, size in memory_usage),
+              "(mapped index file %s)" % format_size(mapped_size))
+
+        # A previous mapped table is left for the garbage collector to unmap
+        # since searches may still be reading from it
+        with self._lock:
+            self._idf_table = search_table
+            self._graph = graph
+            self._global_ranks = global_ranks
+            self._term_dictionary = term_dictionary
+            self._memory_usage = memory_usage
+            self._mapped_size = mapped_size
+        self._ready.set()
+
+        self.remove_old_generations()
+
+    def fit_memory_budget(self, search_table, graph, term_dictionary, idf_table=None, mapped_table=None):
+        """Evict index components to disk until the index fits the memory budget.
+
+        The postings are evicted first, searching the mapped index file where
+        only the pages of queried terms become resident, then the term
+        dictionary, which is switched to reading its terms from the same file.
+        The mapped index scores with the same mode as the table it replaces,
+        so search results do not change. The link graph always stays in
+        memory.
+
+        Returns (search table, term dictionary, [(component, bytes)]).
+        """
+        memory_usage = self.measure_memory(search_table, graph, term_dictionary)
+        if not self.memory_budget_mb:
+            return search_table, term_dictionary, memory_usage
+
+        budget = self.memory_budget_mb * MEGABYTE
+        if sum(size for _, size in memory_usage) <= budget:
+            return search_table, term_dictionary, memory_usage
+
+        if not isinstance(search_table, postings.MappedTfIdfTable):
+            if mapped_table is None and idf_table is not None:
+                mapped_table = self.store_index(idf_table, graph)
+            if mapped_table is None:
+                print("Index exceeds memory budget of", format_size(budget), "and cannot be evicted to disk")
+                return search_table, term_dictionary, memory_usage
+            if mapped_table.scoring != search_table.scoring:
+                # Evicting must not change the ranking
+                print("Index exceeds memory budget of", format_size(budget), "but the mapped index does not score",
+                      search_table.scoring, "- keeping", search_table_name(search_table), "in memory")
+                return search_table, term_dictionary, memory_usage
+
+            print("Index exceeds memory budget of", format_size(budget), "- evicting",
+                  search_table_name(search_table), "to mapped index")
+            search_table = mapped_table
+            memory_usage = self.measure_memory(search_table, graph, term_dictionary)
+
+        if sum(size for _, size in memory_usage) > budget:
+            print("Index exceeds memory budget of", format_size(budget), "- reading term dictionary from mapped index")
+            term_dictionary = termdict.TermDictionary.from_sorted(search_table.sorted_terms(),
+                                                                  search_table.sorted_document_frequencies())
+            memory_usage = self.measure_memory(search_table, graph, term_dictionary)
+
+        return search_table, term_dictionary, memory_usage
+
+    def measure_memory(self, search_table, graph, term_dictionary):
+        return [(search_table_name(search_table), search_table.memory_usage()),
+                ("term dictionary", term_dictionary.memory_usage()),
+                ("link graph", graph.memory_usage())]
+
+    def store_index(self, idf_table, graph):
+        """Write the scanned index and graph to disk and return a table searching the index through mmap.
+
+        Returns None if the index cannot be stored.
+        """
+
+        try:
+            index_path, graph_path = self.new_index_paths()
+            graph.save(graph_path)
+            postings.write_index(idf_table, index_path)
+            mapped_table = postings.MappedTfIdfTable(index_path, self.scoring)
+            print("Stored index:", index_path)
+            return mapped_table
+        except (OSError, ValueError):
+            traceback.print_exc()
+            return None
+
+    def index_key(self):
+        """Name of the stored index files of the project folders"""
+
+        return hashlib.md5("\n".join(self.folders).encode('utf-8')).hexdigest()
+
+    def index_dir(self):
+        return os.path.join(sublime.cache_path(), "FindInProject")
+
+    def index_paths(self, generation):
+        """Locations of the stored index and link graph of a generation"""
+
+        base = os.path.join(self.index_dir(), "%s.%i" % (self.index_key(), generation))
+        return base + ".idx", base + ".graph"
+
+    def _index_files(self):
+        """List (generation, file name) of all files stored for the project folders"""
+
+        prefix = self.index_key() + "."
+        try:
+            names = os.listdir(self.index_dir())
+        except OSError:
+            return []
+
+        index_files = []
+        for name in names:
+            if name.startswith(prefix):
+                generation = name[len(prefix):].split(".")[0]
+                if generation.isdigit():
+                    index_files.append((int(generation), name))
+
+        return index_files
+
+    def stored_generations(self):
+        """Generations with both the index and the link graph stored, oldest first"""
+
+        names = set(name for _, name in self._index_files())
+        generations = set(generation for generation, _ in self._index_files())
+        return sorted(generation for generation in generations
+                      if all(os.path.basename(path) in names for path in self.index_paths(generation)))
+
+    def new_index_paths(self):
+        """Locations for the next generation of the stored index.
+
+        Each scan is stored under new file names, so the index file of the
+        current snapshot is never replaced while it is mapped.
+        """
+        os.makedirs(self.index_dir(), exist_ok=True)
+        generation = max([generation for generation, _ in self._index_files()] + [0]) + 1
+        return self.index_paths(generation)
+
+    def remove_old_generations(self):
+        """Remove the files of generations older than the latest stored one.
+
+        Files still mapped by a snapshot in use cannot be removed on Windows.
+        They are left until a later publish finds them unmapped.
+        """
+        generations = self.stored_generations()
+        if not generations:
+            return
+
+        for generation, name in self._index_files():
+            if generation < generations[-1]:
+                try:
+                    os.remove(os.path.join(self.index_dir(), name))
+                except OSError:
+                    pass
+
+
+class IndexService:
+    """Process wide registry of project indexes shared by all windows.
+
+    Indexes are reference counted per set of project folders: the first
+    window on a project starts the scan and later windows reuse it. The link
+    graph and its ranks span all folders of a project, so windows on
+    overlapping but different folder sets each have their own index. Windows
+    are released once they are found closed, as there is no window close
+    event to listen for.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._window_keys = {}
+
+    def acquire(self, window):
+        """Return the index for the folders of window, creating it if needed."""
+        key = tuple(window.folders())
+
+        with self._lock:
+            self._release_closed_windows()
+
+            previous_key = self._window_keys.get(window.id())
+            if previous_key == key:
+                return self._indexes[key]
+            if previous_key is not None:
+                self._release(previous_key)
+
+            index = self._indexes.get(key)
+            if index is None:
+                index = ProjectIndex(key)
+                self._indexes[key] = index
+                index.refresh()
+
+            index.ref_count += 1
+            self._window_keys[window.id()] = key
+
+            return index
+
+    def shutdown(self):
+        with self._lock:
+            self._indexes.clear()
+            self._window_keys.clear()
+
+    def _release(self, key):
+        index = self._indexes[key]
+        index.ref_count -= 1
+        if index.ref_count <= 0:
+            print("Releasing index for:", key)
+            del self._indexes[key]
+
+    def _release_closed_windows(self):
+        open_window_ids = set(win.id() for win in sublime.windows())
+        for window_id in list(self._window_keys):
+            if window_id not in open_window_ids:
+                self._release(self._window_keys.pop(window_id))
+
+
+_service = IndexService()
+
+
+def get_service():
+    return _service
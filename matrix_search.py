@@ -0,0 +1,136 @@
+import array
+import sys
+
+from . import tfidf_search
+
+# NumPy is optional - it is not bundled with Sublime Text but can be made
+# available as a package dependency
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SCORING_TFIDF = tfidf_search.SCORING_TFIDF
+SCORING_BM25 = tfidf_search.SCORING_BM25
+SCORING_MODES = tfidf_search.SCORING_MODES
+
+
+def is_available():
+    return numpy is not None
+
+
+class MatrixSearchTable:
+    """Search table storing the corpus as a sparse doc-term matrix.
+
+    The matrix is built row by row (CSR) and kept column-major so all
+    documents are scored for a query with a single sparse matrix-vector
+    product in NumPy that only reads the columns of the query terms.
+    Supports BM25 and the TfIdfTable formula.
+    """
+
+    def __init__(self, idf_table, scoring=SCORING_BM25, k1=tfidf_search.BM25_K1, b=tfidf_search.BM25_B):
+        tfidf_search.check_scoring(scoring)
+
+        self.scoring = scoring
+        self.last_coverage = 1.0
+
+        # Build the CSR arrays
+        self._vocabulary = {}
+        self._doc_names = []
+        indptr = array.array('q', [0])
+        indices = array.array('i')
+        counts = array.array('d')
+        doc_lengths = array.array('d')
+        for doc_name, doc_term_counts, doc_length in idf_table.documents:
+            self._doc_names.append(doc_name)
+            doc_lengths.append(doc_length)
+            for term, count in doc_term_counts.items():
+                indices.append(self._vocabulary.setdefault(term, len(self._vocabulary)))
+                counts.append(count)
+            indptr.append(len(indices))
+
+        indptr = numpy.frombuffer(indptr, dtype=numpy.int64)
+        indices = numpy.frombuffer(indices, dtype=numpy.int32)
+        counts = numpy.frombuffer(counts, dtype=numpy.float64)
+        doc_lengths = numpy.frombuffer(doc_lengths, dtype=numpy.float64)
+        rows = numpy.repeat(numpy.arange(len(self._doc_names), dtype=numpy.int32), numpy.diff(indptr))
+
+        overall_term_counts = numpy.zeros(len(self._vocabulary))
+        for term, column in self._vocabulary.items():
+            overall_term_counts[column] = idf_table.overall_term_counts[term]
+        self._overall_term_counts = overall_term_counts
+
+        # Precompute the per value weights of the selected scoring mode
+        row_lengths = doc_lengths[rows]
+        if scoring == SCORING_BM25:
+            doc_count = float(len(self._doc_names))
+            doc_freqs = numpy.bincount(indices, minlength=len(self._vocabulary))
+            idf = numpy.log(1.0 + (doc_count - doc_freqs + 0.5) / (doc_freqs + 0.5))
+
+            average_length = doc_lengths.mean() if len(doc_lengths) else 0.0
+            length_norms = k1 * (1.0 - b + b * row_lengths / max(average_length, 1.0))
+            data = idf[indices] * counts * (k1 + 1.0) / (counts + length_norms)
+        else:
+            data = counts / numpy.maximum(row_lengths, 1.0)
+
+        self._doc_name_array = numpy.array(self._doc_names, dtype=object)
+
+        # Convert CSR to CSC
+        order = numpy.argsort(indices, kind='mergesort')
+        self._colptr = numpy.zeros(len(self._vocabulary) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(indices, minlength=len(self._vocabulary)), out=self._colptr[1:])
+        self._rows = rows[order]
+        self._data = data[order]
+
+    def search(self, search, threshold=0.0, deadline=None):
+        """Score all documents against the search in one pass.
+
+        The deadline is accepted for compatibility with TfIdfTable; scoring
+        is a single vectorised step so there is nothing to stop part way.
+        """
+        search_term_normals = tfidf_search.normalise_search(search)
+
+        print("Searching matrix with", len(self._vocabulary), "terms for", search_term_normals)
+
+        # Gather the query columns with their query weights
+        rows = []
+        weights = []
+        for term, search_term_normal in search_term_normals.items():
+            column = self._vocabulary.get(term)
+            if column is None:
+                continue
+
+            start, end = self._colptr[column], self._colptr[column + 1]
+            rows.append(self._rows[start:end])
+            if self.scoring == SCORING_BM25:
+                weights.append(self._data[start:end] * search_term_normal)
+            else:
+                # (query normal + doc normal) / overall count
+                weights.append((self._data[start:end] + search_term_normal) / self._overall_term_counts[column])
+
+        self.last_coverage = 1.0
+        if not rows:
+            return []
+
+        scores = numpy.bincount(numpy.concatenate(rows), weights=numpy.concatenate(weights),
+                                minlength=len(self._doc_names))
+
+        # Select the matches in NumPy and only then convert them to Python
+        # objects - per element indexing of the arrays would dominate
+        doc_indices = numpy.flatnonzero(scores > threshold)
+        return list(zip(self._doc_name_array[doc_indices].tolist(), scores[doc_indices].tolist()))
+
+    def memory_usage(self):
+        """Estimated bytes held by the matrix and its term and document lookups"""
+        size = sum(values.nbytes for values in (self._colptr, self._rows, self._data, self._overall_term_counts,
+                                                self._doc_name_array))
+        size += sys.getsizeof(self._vocabulary) + sys.getsizeof(self._doc_names)
+        for term, column in self._vocabulary.items():
+            size += sys.getsizeof(term) + sys.getsizeof(column)
+        for doc_name in self._doc_names:
+            size += sys.getsizeof(doc_name)
+
+        return size
+
+    def __len__(self):
+        return len(self._doc_names)
@@ -1,22 +1,51 @@
-import copy
+import array
+import bisect
+import collections
+import itertools
+import operator
+import json
+import os
+import struct
+import sys
+import time
+
+
+# Rank modes - global PageRank is query independent and calculated once per
+# index snapshot, personalised PageRank is calculated per search
+RANK_MODE_GLOBAL = 'global'
+RANK_MODE_PERSONALIZED = 'personalized'
 
 
 class GraphNode:
+    __slots__ = ('index', 'node_id', 'filename')
+
     def __init__(self, node_index, node_id):
         self.index = node_index
         self.node_id = node_id
-        self.in_links = set()
-        self.out_counts = 0
 
     def __repr__(self):
-        return "Node={index=%s, id=%s, in=%s, out=%s}" % \
-               (self.index, self.node_id, repr(self.in_links), self.out_counts)
+        return "Node={index=%s, id=%s}" % (self.index, self.node_id)
 
 
 class Graph:
+    """Directed link graph between pages.
+
+    Node ids are interned to indexes and links are accumulated in typed
+    arrays. finalize() deduplicates them into sorted CSR arrays of out and
+    in links, which is what the rank calculations read, and drops the
+    accumulated link arrays. Adding to a finalized graph restores them from
+    the CSR arrays first.
+    """
+
+    MAGIC = b'FIPGRF01'
+    _HEADER = struct.Struct('<8sQQQ')
+
     def __init__(self):
         self._node_map = {}
         self._node_list = []
+        self._link_sources = array.array('i')
+        self._link_targets = array.array('i')
+        self._csr = None
 
     def __repr__(self):
         return "Graph=%s" % repr(self._node_list)
@@ -33,11 +62,11 @@ class Graph:
     def get_node_by_id(self, node_id):
         return self._node_map[node_id]
 
-
     def add_node(self, node_id):
         if node_id in self._node_map:
             return self._node_map[node_id]
         else:
+            self._thaw()
             node_index = len(self._node_list)
             node = GraphNode(node_index, node_id)
             self._node_map[node_id] = node
@@ -46,16 +75,14 @@ class Graph:
             return node
 
     def add_link(self, source_id, target_id):
-        # Ignore self references
+        # Ignore self references. Repeated connections are removed in finalize.
         if source_id != target_id:
             source_node = self._node_map[source_id]
             target_node = self.add_node(target_id)
 
-            # Ignore repeated connections
-            source_index = source_node.index
-            if source_index not in target_node.in_links:
-                source_node.out_counts += 1
-                target_node.in_links.add(source_index)
+            self._thaw()
+            self._link_sources.append(source_node.index)
+            self._link_targets.append(target_node.index)
 
     def add_links(self, links):
         for source_id, target_id in links:
@@ -70,44 +97,198 @@ class Graph:
 
         return node
 
+    def finalize(self):
+        """Build the sorted, deduplicated CSR link arrays.
+
+        Called lazily by the link accessors. Call it before sharing the graph
+        between threads.
+        """
+        if self._csr is not None:
+            return self._csr
+
+        node_count = len(self._node_list)
+
+        # Pack each link into one source major integer key. Sorting orders
+        # the links by source, then target, and drops repeated links. Links
+        # are mostly added in source order, which the sort benefits from. The
+        # work is done in map() over the arrays to stay out of the interpreter
+        # loop.
+        out_keys = sorted(map(operator.add, map(operator.mul, self._link_sources, itertools.repeat(node_count)),
+                              self._link_targets))
+        out_keys = list(dict.fromkeys(out_keys))
+        out_ptr, out_idx = self._keys_to_csr(out_keys, node_count)
+
+        # The same links keyed target major give the in link arrays
+        in_keys = sorted(map(operator.add, map(operator.mul, out_idx, itertools.repeat(node_count)),
+                             map(operator.floordiv, out_keys, itertools.repeat(node_count))))
+        in_ptr, in_idx = self._keys_to_csr(in_keys, node_count)
+
+        self._link_sources = None
+        self._link_targets = None
+        self._csr = (out_ptr, out_idx, in_ptr, in_idx)
+
+        return self._csr
+
+    @staticmethod
+    def _keys_to_csr(keys, node_count):
+        """Split sorted row major link keys into (row pointers, column indexes)"""
+        row_starts = range(0, (node_count + 1) * node_count, node_count) if node_count else [0]
+        row_ptr = array.array('q', map(bisect.bisect_left, itertools.repeat(keys), row_starts))
+        col_idx = array.array('i', map(operator.mod, keys, itertools.repeat(node_count)))
+        return row_ptr, col_idx
+
+    def _thaw(self):
+        """Restore the link arrays from the CSR arrays before the graph changes"""
+        if self._csr is None:
+            return
+
+        out_ptr, out_idx, _, _ = self._csr
+        self._link_sources = array.array('i', (source for source in range(len(out_ptr) - 1)
+                                               for _ in range(out_ptr[source + 1] - out_ptr[source])))
+        self._link_targets = array.array('i', out_idx)
+        self._csr = None
+
+    def memory_usage(self):
+        """Estimated bytes held by the nodes and link arrays"""
+        size = sys.getsizeof(self._node_map) + sys.getsizeof(self._node_list)
+        for node in self._node_list:
+            size += sys.getsizeof(node) + sys.getsizeof(node.node_id) + sys.getsizeof(getattr(node, 'filename', None))
+
+        arrays = self._csr if self._csr is not None else (self._link_sources, self._link_targets)
+        for values in arrays:
+            size += sys.getsizeof(values)
+
+        return size
+
+    def out_links(self, index):
+        out_ptr, out_idx, _, _ = self.finalize()
+        return out_idx[out_ptr[index]:out_ptr[index + 1]]
+
+    def in_links(self, index):
+        _, _, in_ptr, in_idx = self.finalize()
+        return in_idx[in_ptr[index]:in_ptr[index + 1]]
+
+    def out_count(self, index):
+        out_ptr = self.finalize()[0]
+        return out_ptr[index + 1] - out_ptr[index]
+
+    def save(self, path):
+        """Save the finalized graph, written next to path and moved into place"""
+        out_ptr, out_idx, in_ptr, in_idx = self.finalize()
+        nodes = json.dumps([[node.node_id, getattr(node, 'filename', None)] for node in self._node_list])
+        nodes = nodes.encode('utf-8')
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(self._HEADER.pack(self.MAGIC, len(self._node_list), len(out_idx), len(nodes)))
+            f.write(nodes)
+            out_ptr.tofile(f)
+            out_idx.tofile(f)
+            in_ptr.tofile(f)
+            in_idx.tofile(f)
+
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        graph = cls()
+        with open(path, 'rb') as f:
+            try:
+                magic, node_count, link_count, nodes_length = cls._HEADER.unpack(f.read(cls._HEADER.size))
+            except struct.error:
+                raise ValueError("Truncated graph file: %s" % path)
+            if magic != cls.MAGIC:
+                raise ValueError("Unsupported graph file: %s" % path)
+
+            nodes = f.read(nodes_length)
+            if len(nodes) != nodes_length:
+                raise ValueError("Truncated graph file: %s" % path)
+
+            for node_id, filename in json.loads(nodes.decode('utf-8')):
+                node = graph.add_node(node_id)
+                if filename is not None:
+                    node.filename = filename
+
+            csr = []
+            for item_type, count in (('q', node_count + 1), ('i', link_count),
+                                     ('q', node_count + 1), ('i', link_count)):
+                values = array.array(item_type)
+                try:
+                    values.fromfile(f, count)
+                except EOFError:
+                    raise ValueError("Truncated graph file: %s" % path)
+                csr.append(values)
+
+        graph._link_sources = None
+        graph._link_targets = None
+        graph._csr = tuple(csr)
+
+        return graph
+
+
+def file_ranks(graph, page_ranks):
+    """Map the ranks of pages to their files.
+
+    Returns ({filename: rank}, sum of the mapped ranks). Referenced pages
+    without a file are left out.
+    """
+    sum_ranks = 0.0
+    rank_mappings = {}
+    missing_pages = []
+    for pagename, rank in page_ranks:
+        node = graph.get_node_by_id(pagename)
+        if hasattr(node, 'filename'):
+            sum_ranks += rank
+            rank_mappings[node.filename] = rank
+        else:
+            missing_pages.append(pagename)
+
+    if missing_pages:
+        print("Missing pages: ", len(missing_pages), missing_pages[:20])
+
+    return rank_mappings, sum_ranks
+
 
 class PageRank:
     def __init__(self, _graph: Graph):
-        self._graph = copy.copy(_graph)
-        self._apply_sink_linking()
+        self._graph = _graph
+        self.timed_out = False
 
     def __repr__(self):
         return "PageRank{%s}" % (repr(self._graph))
 
-    def _apply_sink_linking(self):
-        number_of_nodes = len(self._graph)
-        for source_id, source_node in self._graph:
-            if source_node.out_counts == 0:
-                source_node.out_counts = number_of_nodes
-                self._add_link_to_all_nodes(source_node.index)
-
-    def _add_link_to_all_nodes(self, source_index):
-        for target_id, target_node in self._graph:
-            target_node.in_links.add(source_index)
-
-    def _out_count(self, index):
-        return self._graph[index].out_counts
-
-    def calculate(self, damping=0.85, epsilon=1.0e-5):
+    def calculate(self, damping=0.85, epsilon=1.0e-5, deadline=None):
+        """Iterate until the ranks converge, or the deadline (as returned by
+        time.time()) passes. Ranks stopped by the deadline are approximate.
+        """
         page_count = len(self._graph)
         damping_per_page = (1 - damping) / page_count
+        out_ptr, _, in_ptr, in_idx = self._graph.finalize()
+
+        out_counts = [out_ptr[idx + 1] - out_ptr[idx] for idx in range(page_count)]
+
+        # Sinks link to every page, including themselves. Rather than adding
+        # those links their rank is shared out evenly to all pages.
+        sinks = [idx for idx, out_count in enumerate(out_counts) if out_count == 0]
 
         # Prepare for calculation
-        ranks = [(1 / len(self._graph))] * page_count
-        next_ranks = [0] * page_count
+        ranks = [(1 / page_count)] * page_count
         delta = 1.0
         iteration_count = 0
+        self.timed_out = False
 
         while delta > epsilon:
+            if deadline is not None and iteration_count and time.time() > deadline:
+                self.timed_out = True
+                print("Rank deadline reached after", iteration_count, "iterations")
+                break
+
             # Calculate next rank values...
-            for _, page in self._graph:
-                next_ranks[page.index] = damping_per_page + \
-                                         damping * sum(ranks[idx] / self._out_count(idx) for idx in page.in_links)
+            shares = [rank / out_count if out_count else 0.0 for rank, out_count in zip(ranks, out_counts)]
+            sink_share = damping * sum(ranks[idx] for idx in sinks) / page_count
+            next_ranks = [damping_per_page + sink_share +
+                          damping * sum(shares[idx] for idx in in_idx[in_ptr[page]:in_ptr[page + 1]])
+                          for page in range(page_count)]
 
             # Calculate the delta between the current rank values and the next rank values...
             delta = sum(abs(next_rank - ranks[idx]) for idx, next_rank in enumerate(next_ranks))
@@ -123,6 +304,88 @@ class PageRank:
         return page_ranks, iteration_count
 
 
+class PersonalizedPageRank:
+    """PageRank biased towards a set of seed pages.
+
+    Approximated with the local push algorithm (Andersen, Chung & Lang) so
+    only the neighbourhood of the seeds is visited, which makes it cheap
+    enough to run for every search.
+    """
+    def __init__(self, _graph: Graph):
+        self._graph = _graph
+        self.timed_out = False
+
+    def __repr__(self):
+        return "PersonalizedPageRank{%s}" % (repr(self._graph))
+
+    def calculate(self, seeds, damping=0.85, epsilon=1.0e-4, deadline=None):
+        """Calculate ranks for the seeds, a mapping of node id to weight.
+
+        Returns the visited pages sorted by rank desc and the number of
+        pushes. Pages that were not visited have a negligible rank. If the
+        deadline (as returned by time.time()) passes, pushing stops and the
+        ranks found so far are returned - they are lower bounds of the
+        converged ranks.
+        """
+        self.timed_out = False
+
+        # Normalise the seed weights into the teleport distribution
+        teleport = {}
+        for node_id, weight in seeds.items():
+            try:
+                node = self._graph.get_node_by_id(node_id)
+            except KeyError:
+                continue
+            teleport[node.index] = teleport.get(node.index, 0.0) + weight
+
+        total_weight = sum(teleport.values())
+        if total_weight <= 0.0:
+            return [], 0
+        for index in teleport:
+            teleport[index] /= total_weight
+
+        ranks = {}
+        residuals = dict(teleport)
+        pending = collections.deque(residuals)
+        queued = set(residuals)
+        push_count = 0
+
+        while pending:
+            if deadline is not None and push_count % 256 == 0 and push_count and time.time() > deadline:
+                self.timed_out = True
+                print("Rank deadline reached after", push_count, "pushes")
+                break
+
+            index = pending.popleft()
+            queued.discard(index)
+
+            residual = residuals.pop(index, 0.0)
+            ranks[index] = ranks.get(index, 0.0) + (1 - damping) * residual
+            push_count += 1
+
+            # Spread the remaining mass over the out links. Sinks send it back
+            # to the seeds, matching the teleport of a personalised walk.
+            out_links = self._graph.out_links(index)
+            if out_links:
+                targets = [(target, 1.0 / len(out_links)) for target in out_links]
+            else:
+                targets = teleport.items()
+
+            for target, share in targets:
+                target_residual = residuals.get(target, 0.0) + damping * residual * share
+                residuals[target] = target_residual
+                if target not in queued and \
+                        target_residual > epsilon * max(self._graph.out_count(target), 1):
+                    queued.add(target)
+                    pending.append(target)
+
+        # List pages sorted by rank desc
+        page_ranks = list((self._graph[idx].node_id, rank) for idx, rank in ranks.items())
+        page_ranks.sort(reverse=True, key=lambda x: x[1])
+
+        return page_ranks, push_count
+
+
 if __name__ == '__main__':
     connections = [('A', 'B'), ('A', 'D'), ('D', 'B'), ('E', 'B'), ('B', 'C'), ]
     print('Connections:', connections)
@@ -132,3 +395,6 @@ if __name__ == '__main__':
 
     page_rank = PageRank(graph)
     print(page_rank.calculate(epsilon=1.0e-3))
+
+    personalized_page_rank = PersonalizedPageRank(graph)
+    print(personalized_page_rank.calculate({'A': 1.0}))
@@ -0,0 +1,351 @@
+import mmap
+import os
+import struct
+import sys
+import time
+
+from . import tfidf_search
+
+# On disk layout (all integers little endian):
+#
+#   header        MAGIC, version, doc count, term count, section offsets
+#   doc offsets   uint64 * (doc count + 1) into the doc names blob
+#   doc lengths   uint32 * doc count
+#   doc names     utf-8 encoded document names, back to back
+#   term offsets  uint64 * (term count + 1) into the term dictionary blob
+#   term dict     per term (sorted by utf-8 bytes):
+#                   varint term length, term bytes, varint doc frequency,
+#                   varint overall count, varint postings offset,
+#                   varint postings length
+#   postings      per term: varint (doc index delta, term count) pairs
+MAGIC = b'FIPIDX01'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIIIQQQQQQ')
+_OFFSET = struct.Struct('<Q')
+_LENGTH = struct.Struct('<I')
+
+
+def _encode_varint(value, out):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def write_index(idf_table, path):
+    """Write a TfIdfTable to path in the compressed postings format.
+
+    The file is written next to path and moved into place once complete so
+    readers never see a partially written index.
+    """
+    # Invert the document vectors into postings lists
+    postings = {}
+    doc_names = []
+    doc_lengths = []
+    for doc_index, (doc_name, doc_term_counts, doc_length) in enumerate(idf_table.documents):
+        doc_names.append(doc_name.encode('utf-8'))
+        doc_lengths.append(int(doc_length))
+        for term, count in doc_term_counts.items():
+            postings.setdefault(term, []).append((doc_index, int(count)))
+
+    encoded_terms = sorted((term.encode('utf-8'), term) for term in postings)
+
+    # Encode postings and the term dictionary
+    postings_blob = bytearray()
+    term_blob = bytearray()
+    term_offsets = []
+    for term_bytes, term in encoded_terms:
+        term_postings = postings[term]
+        postings_start = len(postings_blob)
+        prev_index = 0
+        for doc_index, count in term_postings:
+            _encode_varint(doc_index - prev_index, postings_blob)
+            _encode_varint(count, postings_blob)
+            prev_index = doc_index
+
+        term_offsets.append(len(term_blob))
+        _encode_varint(len(term_bytes), term_blob)
+        term_blob.extend(term_bytes)
+        _encode_varint(len(term_postings), term_blob)
+        _encode_varint(int(idf_table.overall_term_counts[term]), term_blob)
+        _encode_varint(postings_start, term_blob)
+        _encode_varint(len(postings_blob) - postings_start, term_blob)
+    term_offsets.append(len(term_blob))
+
+    doc_offsets = [0]
+    for name in doc_names:
+        doc_offsets.append(doc_offsets[-1] + len(name))
+
+    # Lay out the sections
+    doc_offsets_pos = _HEADER.size
+    doc_lengths_pos = doc_offsets_pos + _OFFSET.size * len(doc_offsets)
+    doc_names_pos = doc_lengths_pos + _LENGTH.size * len(doc_lengths)
+    term_offsets_pos = doc_names_pos + doc_offsets[-1]
+    term_dict_pos = term_offsets_pos + _OFFSET.size * len(term_offsets)
+    postings_pos = term_dict_pos + len(term_blob)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(doc_names), len(encoded_terms),
+                             doc_offsets_pos, doc_lengths_pos, doc_names_pos,
+                             term_offsets_pos, term_dict_pos, postings_pos))
+        f.write(struct.pack('<%dQ' % len(doc_offsets), *doc_offsets))
+        f.write(struct.pack('<%dI' % len(doc_lengths), *doc_lengths))
+        for name in doc_names:
+            f.write(name)
+        f.write(struct.pack('<%dQ' % len(term_offsets), *term_offsets))
+        f.write(term_blob)
+        f.write(postings_blob)
+
+    os.replace(tmp_path, path)
+
+
+class MappedSequence:
+    """Read only sequence whose items are decoded from a mapped index on access.
+
+    Supports len, indexing and slicing, which is what bisect and the term
+    dictionary need.
+    """
+    def __init__(self, length, item_at):
+        self._length = length
+        self._item_at = item_at
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._item_at(i) for i in range(*index.indices(self._length))]
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("index out of range")
+
+        return self._item_at(index)
+
+
+class MappedTfIdfTable:
+    """Read only TfIdfTable backed by a memory mapped postings file.
+
+    Only the postings lists of the terms in a query are decoded, so opening
+    the table is cheap and resident memory follows the queried terms.
+    Scores with tf-idf or BM25 like TfIdfTable.
+    """
+    def __init__(self, path, scoring=tfidf_search.SCORING_TFIDF):
+        tfidf_search.check_scoring(scoring)
+
+        self.path = path
+        self.scoring = scoring
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.last_coverage = 1.0
+
+        try:
+            self._check_layout()
+        except ValueError:
+            self._mm.close()
+            raise
+
+        self._average_length = None
+
+    def _check_layout(self):
+        """Read the header and check the sections fill the file exactly.
+
+        Raises ValueError for files of another format and for truncated
+        files, which would otherwise fail on the first query.
+        """
+        if len(self._mm) < _HEADER.size:
+            raise ValueError("Truncated index file: %s" % self.path)
+
+        (magic, version, self._doc_count, self._term_count,
+         self._doc_offsets_pos, self._doc_lengths_pos, self._doc_names_pos,
+         self._term_offsets_pos, self._term_dict_pos, self._postings_pos) = _HEADER.unpack_from(self._mm, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unsupported index file: %s" % self.path)
+
+        try:
+            names_length = _OFFSET.unpack_from(self._mm, self._doc_offsets_pos + _OFFSET.size * self._doc_count)[0]
+            term_dict_length = _OFFSET.unpack_from(
+                self._mm, self._term_offsets_pos + _OFFSET.size * self._term_count)[0]
+
+            postings_length = 0
+            if self._term_count:
+                entry = self._term_entry(self._term_at(self._term_count - 1)[1])
+                postings_length = entry[2] + entry[3]
+        except (IndexError, struct.error):
+            raise ValueError("Truncated index file: %s" % self.path)
+
+        if (self._doc_offsets_pos != _HEADER.size or
+                self._doc_lengths_pos != self._doc_offsets_pos + _OFFSET.size * (self._doc_count + 1) or
+                self._doc_names_pos != self._doc_lengths_pos + _LENGTH.size * self._doc_count or
+                self._term_offsets_pos != self._doc_names_pos + names_length or
+                self._term_dict_pos != self._term_offsets_pos + _OFFSET.size * (self._term_count + 1) or
+                self._postings_pos != self._term_dict_pos + term_dict_length or
+                self._postings_pos + postings_length != len(self._mm)):
+            raise ValueError("Truncated index file: %s" % self.path)
+
+    def close(self):
+        self._mm.close()
+
+    def _doc_name(self, doc_index):
+        start, end = struct.unpack_from('<2Q', self._mm, self._doc_offsets_pos + _OFFSET.size * doc_index)
+        start += self._doc_names_pos
+        end += self._doc_names_pos
+        return self._mm[start:end].decode('utf-8')
+
+    def _doc_length(self, doc_index):
+        return _LENGTH.unpack_from(self._mm, self._doc_lengths_pos + _LENGTH.size * doc_index)[0]
+
+    def _term_at(self, term_index):
+        pos = self._term_dict_pos + _OFFSET.unpack_from(
+            self._mm, self._term_offsets_pos + _OFFSET.size * term_index)[0]
+        length, pos = _decode_varint(self._mm, pos)
+        return self._mm[pos:pos + length], pos + length
+
+    def _decoded_term_at(self, term_index):
+        return self._term_at(term_index)[0].decode('utf-8')
+
+    def _doc_frequency_at(self, term_index):
+        return _decode_varint(self._mm, self._term_at(term_index)[1])[0]
+
+    def _term_entry(self, pos):
+        """Decode the dictionary entry following a term at pos"""
+        entry = []
+        for _ in range(4):
+            value, pos = _decode_varint(self._mm, pos)
+            entry.append(value)
+        return entry
+
+    def _find_term(self, term):
+        """Binary search the term dictionary.
+
+        Returns (doc frequency, overall count, postings offset, postings
+        length) or None if the term is not indexed.
+        """
+        target = term.encode('utf-8')
+        lo, hi = 0, self._term_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            term_bytes, pos = self._term_at(mid)
+            if term_bytes < target:
+                lo = mid + 1
+            elif term_bytes > target:
+                hi = mid
+            else:
+                return self._term_entry(pos)
+
+        return None
+
+    def sorted_terms(self):
+        """The indexed terms in sorted order, decoded on access"""
+        return MappedSequence(self._term_count, self._decoded_term_at)
+
+    def sorted_document_frequencies(self):
+        """Document frequencies in the order of sorted_terms(), decoded on access"""
+        return MappedSequence(self._term_count, self._doc_frequency_at)
+
+    def document_frequencies(self):
+        """Number of documents containing each term"""
+        doc_freqs = {}
+        for term_index in range(self._term_count):
+            term_bytes, pos = self._term_at(term_index)
+            doc_freqs[term_bytes.decode('utf-8')] = _decode_varint(self._mm, pos)[0]
+
+        return doc_freqs
+
+    def average_length(self):
+        """Average document length, read on first use"""
+        if self._average_length is None:
+            lengths = struct.unpack_from('<%dI' % self._doc_count, self._mm, self._doc_lengths_pos)
+            self._average_length = sum(lengths) / float(self._doc_count) if self._doc_count else 0.0
+
+        return self._average_length
+
+    def _postings(self, offset, length):
+        pos = self._postings_pos + offset
+        end = pos + length
+        doc_index = 0
+        while pos < end:
+            delta, pos = _decode_varint(self._mm, pos)
+            count, pos = _decode_varint(self._mm, pos)
+            doc_index += delta
+            yield doc_index, count
+
+    def search(self, search, threshold=0.0, deadline=None):
+        search_term_normals = tfidf_search.normalise_search(search)
+
+        print("Searching mapped index with", self._term_count, "terms for", search_term_normals)
+
+        # Accumulate term scores per document from the touched postings only
+        doc_scores = {}
+        postings_total = 0
+        postings_scored = 0
+        terms = []
+        for term, search_term_normal in search_term_normals.items():
+            entry = self._find_term(term)
+            if entry is not None:
+                terms.append((search_term_normal, entry))
+                postings_total += entry[0]
+
+        # Rarest terms first - they weigh the most, so a search stopped by the
+        # deadline has scored the best matches
+        terms.sort(key=lambda term: term[1][1])
+
+        bm25 = self.scoring == tfidf_search.SCORING_BM25
+        average_length = self.average_length() if bm25 else 0.0
+
+        self.last_coverage = 1.0
+        for search_term_normal, (doc_freq, overall_term_count, offset, length) in terms:
+            idf = tfidf_search.bm25_idf(self._doc_count, doc_freq)
+            for doc_index, count in self._postings(offset, length):
+                if deadline is not None and postings_scored and \
+                        postings_scored % tfidf_search.DEADLINE_CHECK_INTERVAL == 0 and time.time() > deadline:
+                    self.last_coverage = postings_scored / float(postings_total)
+                    break
+
+                doc_length = float(self._doc_length(doc_index))
+                if bm25:
+                    score = idf * tfidf_search.bm25_term_weight(count, doc_length, average_length) * \
+                        search_term_normal
+                else:
+                    score = (search_term_normal + count / doc_length) / overall_term_count
+                doc_scores[doc_index] = doc_scores.get(doc_index, 0.0) + score
+                postings_scored += 1
+
+            if self.last_coverage < 1.0:
+                print("Search deadline reached after scoring", postings_scored, "postings")
+                break
+
+        return [(self._doc_name(doc_index), score)
+                for doc_index, score in sorted(doc_scores.items())
+                if score > threshold]
+
+    def memory_usage(self):
+        """Bytes held outside the mapped file.
+
+        Terms and postings stay in the file, which the OS pages in for the
+        queried terms and can drop again under memory pressure.
+        """
+        return sys.getsizeof(self) + sys.getsizeof(self.__dict__)
+
+    def mapped_size(self):
+        return len(self._mm)
+
+    def __len__(self):
+        return self._doc_count
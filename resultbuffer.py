@@ -1,17 +1,45 @@
 import time
+import bisect
+import threading
 
 import sublime
 import sublime_plugin
 
+# Open result buffers by view id
+_result_buffers = {}
+
+
+def get_result_buffer(view):
+    """
+    Get the result buffer shown in the provided view (if any).
+    """
+    return _result_buffers.get(view.id())
+
 
 class ResultBuffer:
     """
     A result buffer for search results.
+
+    All results are kept in a compact result store while only the first page
+    of files is rendered in the view. Further pages are rendered on demand.
     """
     def __init__(self, win, target_string):
         self.win = win
         self.target_string = target_string
 
+        settings = sublime.load_settings('FindInProject.sublime-settings')
+        self.page_size = settings.get('find_in_project_result_page_size', 100)
+
+        # Result store and the view rows of the rendered files
+        self.results = []
+        self.file_rows = []
+        self.rendered_rows = 0
+        self.render_limit = self.page_size
+        self.footer = ""
+
+        # Results are inserted by the search while pages are loaded from commands
+        self._lock = threading.RLock()
+
         # Get new view
         view = self.win.new_file()
 
@@ -32,6 +60,7 @@ class ResultBuffer:
 
         # Save view for later
         self.view = view
+        _result_buffers[view.id()] = self
 
     def insert_result(self, result):
         """
@@ -40,19 +69,101 @@ class ResultBuffer:
         if len(result) == 0:
             return
 
+        with self._lock:
+            self.results.append((result["filepath"], result["result"]))
+
+            if self.page_size == 0 or len(self.file_rows) < self.render_limit:
+                self._render_file(len(self.results) - 1)
+            elif not self.footer:
+                self._set_footer("\n[More results - press enter to show the next %i files]\n" % self.page_size)
+
+    def has_more(self):
+        """
+        Check if there are stored results that are not rendered yet.
+        """
+        return len(self.file_rows) < len(self.results)
+
+    def load_more(self):
+        """
+        Render the next page of stored results.
+        """
+        with self._lock:
+            if not self.has_more():
+                return
+
+            self._set_footer("")
+            self.render_limit += self.page_size
+            while self.has_more() and len(self.file_rows) < self.render_limit:
+                self._render_file(len(self.file_rows))
+
+            if self.has_more():
+                self._set_footer("\n[More results - press enter to show the next %i files]\n" % self.page_size)
+
+    def _render_file(self, file_index):
+        filepath, lines = self.results[file_index]
+
         # Add file name to start of result block
-        no_results = str(len(result["result"]))
-        result_str = ("\n" + result["filepath"] + " (" + no_results + ")\n")
+        no_results = str(len(lines))
+        result_str = ("\n" + filepath + " (" + no_results + ")\n")
 
         # For each result in file add an indented line
-        for line in result["result"].keys():
-            result_str += (str(line).rjust(6) + ": " + result["result"][line])
+        for line in lines.keys():
+            result_str += (str(line).rjust(6) + ": " + lines[line])
             if result_str[-1] != "\n":
                 result_str += "\n"
 
+        self.file_rows.append(self.rendered_rows + 1)
+        self.rendered_rows += result_str.count("\n")
+
         self.view.run_command("find_in_project_insert_text",
                                      {"args": {'text': result_str, 'target_string': self.target_string}})
 
+    def _set_footer(self, footer):
+        self.view.run_command("find_in_project_set_footer", {"old_length": len(self.footer), "text": footer})
+        self.footer = footer
+
+    def is_footer_row(self, row):
+        """
+        Check if the provided view row shows the load more footer.
+        """
+        return bool(self.footer) and row > self.rendered_rows
+
+    def file_index_at_row(self, row):
+        """
+        Get the index of the rendered file whose result block contains the
+        provided view row, or -1 if the row is before the first file.
+        """
+        return bisect.bisect_right(self.file_rows, row) - 1
+
+    def location_at_row(self, row):
+        """
+        Get (filepath, line number) for the provided view row. Line number is
+        None on a filename row. Returns None if the row is not a result.
+        """
+        file_index = self.file_index_at_row(row)
+        if file_index < 0 or self.is_footer_row(row):
+            return None
+
+        filepath, lines = self.results[file_index]
+        hit_index = row - self.file_rows[file_index] - 1
+        if hit_index < 0:
+            return (filepath, None)
+        if hit_index >= len(lines):
+            return None
+
+        line_no = list(lines.keys())[hit_index]
+        if line_no == 0:
+            # Warning line
+            return (filepath, None)
+        return (filepath, line_no)
+
+    def file_block_rows(self, file_index):
+        """
+        Get the rows of the filename and the last result of a rendered file.
+        """
+        file_row = self.file_rows[file_index]
+        return file_row, file_row + len(self.results[file_index][1])
+
     def is_closed(self):
         """
         Check if the result buffer was closed by the user.
@@ -80,6 +191,14 @@ def set_proper_scheme(view):
         view.settings().set('color_scheme', color_scheme)
 
 
+class FindInProjectResultListener(sublime_plugin.EventListener):
+    """
+    Forget the result store when a result view is closed.
+    """
+    def on_close(self, view):
+        _result_buffers.pop(view.id(), None)
+
+
 class FindInProjectCommand:
     """
     Utility functions for find in project commands. Intended to be used with
@@ -129,6 +248,15 @@ class FindInProjectCommand:
             return True
         return False
 
+    def select_row(self, row):
+        """
+        Move the cursor to the start of the provided row
+        """
+        target = self.view.text_point(row, 0)
+        self.view.sel().clear()
+        self.view.sel().add(sublime.Region(target))
+        self.view.show(target)
+
 
 class FindInProjectInsertText(FindInProjectCommand, sublime_plugin.TextCommand):
     """
@@ -179,6 +307,18 @@ class FindInProjectInsertText(FindInProjectCommand, sublime_plugin.TextCommand):
         self.view.add_regions(key, target_regions, "findinproject.targetstring", flags=flags)
 
 
+class FindInProjectSetFooter(sublime_plugin.TextCommand):
+    """
+    Replace the footer text at the end of the view.
+    """
+    def run(self, edit, old_length, text):
+        end = self.view.size()
+        self.view.set_read_only(False)
+        self.view.erase(edit, sublime.Region(end - old_length, end))
+        self.view.insert(edit, end - old_length, text)
+        self.view.set_read_only(True)
+
+
 class FindInProjectNextLine(FindInProjectCommand, sublime_plugin.TextCommand):
     """
     Go up or down a line in the result view but skip empty lines.
@@ -202,6 +342,11 @@ class FindInProjectNextFile(FindInProjectCommand, sublime_plugin.TextCommand):
     Go up/down to next/previous file.
     """
     def run(self, edit, forward=True):
+        result_buffer = get_result_buffer(self.view)
+        if result_buffer is not None:
+            self._goto_file(result_buffer, forward)
+            return
+
         # Move a step in requested direction
         self.view.run_command("move", {"by": "lines", "forward": forward})
         point = self.get_point_at_start_of_selection()
@@ -214,6 +359,27 @@ class FindInProjectNextFile(FindInProjectCommand, sublime_plugin.TextCommand):
                 # We are stuck at BOF or EOF
                 return
 
+    def _goto_file(self, result_buffer, forward):
+        """
+        Go to the next/previous file using the rows of the result store
+        """
+        (row, col) = self.view.rowcol(self.view.sel()[0].begin())
+        file_index = result_buffer.file_index_at_row(row)
+        if forward:
+            file_index += 1
+            if file_index >= len(result_buffer.file_rows):
+                # Render the next page when moving past the last file
+                if not result_buffer.has_more():
+                    return
+                result_buffer.load_more()
+        else:
+            if file_index >= 0 and row == result_buffer.file_rows[file_index]:
+                file_index -= 1
+            if file_index < 0:
+                return
+
+        self.select_row(result_buffer.file_rows[file_index])
+
 
 class FindInProjectOpenResult(FindInProjectCommand, sublime_plugin.TextCommand):
     """
@@ -222,6 +388,24 @@ class FindInProjectOpenResult(FindInProjectCommand, sublime_plugin.TextCommand):
     def run(self, edit):
         (row, col) = self.view.rowcol(self.view.sel()[0].begin())
 
+        # Look up the result in the result store
+        result_buffer = get_result_buffer(self.view)
+        if result_buffer is not None:
+            if result_buffer.is_footer_row(row):
+                result_buffer.load_more()
+                return
+
+            location = result_buffer.location_at_row(row)
+            if location is None:
+                return
+
+            filename, line_no = location
+            if line_no is None:
+                self.view.window().open_file(filename)
+            else:
+                self.view.window().open_file(filename + ":" + str(line_no), sublime.ENCODED_POSITION)
+            return
+
         # If cursor is standing on a filename line
         point = self.view.text_point(row, 0)
         if self.point_is_file(point):
@@ -257,6 +441,23 @@ class FindInProjectFold(FindInProjectCommand, sublime_plugin.TextCommand):
         if row < 1:
             return
 
+        # Look up the result block in the result store
+        result_buffer = get_result_buffer(self.view)
+        if result_buffer is not None:
+            file_index = result_buffer.file_index_at_row(row)
+            if file_index < 0 or result_buffer.is_footer_row(row):
+                return
+
+            file_row, last_row = result_buffer.file_block_rows(file_index)
+            folding_region = sublime.Region(self.view.line(self.view.text_point(file_row, 0)).end(),
+                                            self.view.line(self.view.text_point(last_row, 0)).end())
+            if fold:
+                self.view.fold(folding_region)
+                self.select_row(file_row)
+            else:
+                self.view.unfold(folding_region)
+            return
+
         # Go upwards and find filename
         point = self.view.text_point(row, 0)
         while self.point_is_file(point) == False:
@@ -1,9 +1,123 @@
 # import traceback
 import os
+import sys
+import collections
+import threading
+
+# Estimated bytes held per cached line besides the line itself - the
+# (line number, line) tuple and the line number
+_CACHED_LINE_OVERHEAD = sys.getsizeof((0, '')) + sys.getsizeof(0)
+
+
+class LineCache:
+    """
+    Bounded LRU cache of the decoded lines of files, so repeated and refined
+    searches over the same files are served from memory.
+
+    * Entries are keyed by path and only used while the size and modification
+      time of the file are unchanged
+    * Bounded by the estimated size of the cached lines
+    * Each search reads under its own generation and never evicts the files
+      it has already read. Files are searched in rank order, so a search
+      over more files than fit keeps the best ranked ones cached instead of
+      cycling every file through the cache.
+    * Shared by threads - all access is locked
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._entries = collections.OrderedDict()
+
+    def resize(self, capacity):
+        with self._lock:
+            self.capacity = capacity
+            while self.size > self.capacity and self._entries:
+                self._evict_oldest()
+
+    def new_generation(self):
+        with self._lock:
+            self._generation += 1
+            return self._generation
+
+    def max_entry_size(self):
+        """Files larger than this are not cached so one file cannot flush the cache"""
+        return self.capacity // 4
+
+    def get(self, path, stamp, generation):
+        """Return the cached (line number, line) list of path, None if missing or stale"""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] != stamp:
+                del self._entries[path]
+                self.size -= entry[2]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(path)
+            entry[3] = generation
+            self.hits += 1
+            return entry[1]
+
+    def put(self, path, stamp, lines, size, generation):
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self.size -= previous[2]
+
+            while self.size + size > self.capacity and self._entries:
+                # Only files read by earlier generations are evicted
+                if next(iter(self._entries.values()))[3] == generation:
+                    return
+                self._evict_oldest()
+
+            if self.size + size <= self.capacity:
+                self._entries[path] = [stamp, lines, size, generation]
+                self.size += size
+
+    def hit_rate(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return self.hits / float(lookups) if lookups else 0.0
+
+    def _evict_oldest(self):
+        _, (_, _, size, _) = self._entries.popitem(last=False)
+        self.size -= size
+
+
+_line_cache = None
+_line_cache_lock = threading.Lock()
+
+
+def get_line_cache(settings):
+    """
+    Get the line cache shared by the searches in this process, sized by the
+    settings. Returns None if the cache is disabled.
+    """
+    global _line_cache
+
+    capacity = int(settings.get('find_in_project_line_cache_mb', 32)*1000000)
+    if capacity <= 0:
+        return None
+
+    with _line_cache_lock:
+        if _line_cache is None:
+            _line_cache = LineCache(capacity)
+        elif _line_cache.capacity != capacity:
+            _line_cache.resize(capacity)
+
+        return _line_cache
 
 
 class FileScanner:
-    def __init__(self, settings):
+    def __init__(self, settings, line_cache=None):
         self.show_warning_on_open_fail = settings.get('find_in_project_show_warning_on_open_failure', False)
         self.encodings = settings.get('find_in_project_encodings', ["utf-8"])
         self.skip_binary = settings.get('find_in_project_skip_binary_files', True)
@@ -14,40 +128,84 @@ class FileScanner:
         exts_to_ignore = settings.get('find_in_project_ignore_extensions', [])
         self.exts_to_ignore = [x.lower() for x in exts_to_ignore]
 
+        self.line_cache = line_cache
+        self.cache_generation = line_cache.new_generation() if line_cache is not None else None
+        self.cache_hits = 0
+
         self.warnings = []
 
     def read_lines(self, filename):
         if self._should_include_file(filename):
-            for enc in self.encodings:
-                try:
-                    # Read file line by line
-                    with open(filename, "r", encoding=enc) as f:
-                        line_no = 0
-                        while True:
-                            line_no += 1
-                            line = f.readline()
-                            if not line:
-                                break
-
-                            if self.skip_binary and '\0' in line:
-                                if self.show_warning_binary_skip:
-                                    self.warnings.append(
-                                        "Skipped binary file.")
-                                    return
-                            else:
-                                yield (line_no, line)
-
-                        return
-
-                except UnicodeDecodeError:
-                    # Probably using wrong encoding
-                    # traceback.print_exc()
-                    continue
-
-            print("Unable to read file:", filename)
-            if self.show_warning_on_open_fail:
-                self.warnings.append(
-                    "Failed to open file. This could be due to unknown/unspecified encoding.")
+            if self.line_cache is None:
+                yield from self._read_file(filename)
+                return
+
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                yield from self._read_file(filename)
+                return
+
+            stamp = (stat.st_size, stat.st_mtime_ns)
+            lines = self.line_cache.get(filename, stamp, self.cache_generation)
+            if lines is not None:
+                self.cache_hits += 1
+                yield from lines
+                return
+
+            # Collect the lines while passing them on. Files producing
+            # warnings or too large for the cache are not cached.
+            lines = []
+            size = sys.getsizeof(lines)
+            max_size = self.line_cache.max_entry_size()
+            warning_count = len(self.warnings)
+            for line in self._read_file(filename):
+                if lines is not None:
+                    size += sys.getsizeof(line[1]) + _CACHED_LINE_OVERHEAD
+                    if size > max_size:
+                        lines = None
+                    else:
+                        lines.append(line)
+                yield line
+
+            if lines is not None and len(self.warnings) == warning_count:
+                self.line_cache.put(filename, stamp, lines, size, self.cache_generation)
+
+    def _read_file(self, filename):
+        for enc in self.encodings:
+            try:
+                # Read file line by line
+                with open(filename, "r", encoding=enc) as f:
+                    line_no = 0
+                    while True:
+                        line_no += 1
+                        line = f.readline()
+                        if not line:
+                            break
+
+                        if self.skip_binary and '\0' in line:
+                            if self.show_warning_binary_skip:
+                                self.warnings.append(
+                                    "Skipped binary file.")
+                                return
+                        else:
+                            yield (line_no, line)
+
+                    return
+
+            except UnicodeDecodeError:
+                # Probably using wrong encoding
+                # traceback.print_exc()
+                continue
+            except OSError as e:
+                # Removed, unreadable or a broken link
+                print("Unable to open file:", filename, e)
+                break
+
+        print("Unable to read file:", filename)
+        if self.show_warning_on_open_fail:
+            self.warnings.append(
+                "Failed to open file. This could be due to unknown/unspecified encoding.")
 
     def _should_include_file(self, filename):
         file_extension = os.path.splitext(filename)[1][1:]
@@ -55,7 +213,13 @@ class FileScanner:
             print('Skipping file with ignored extension: ', filename)
             return False
 
-        file_size = os.path.getsize(filename)
+        try:
+            file_size = os.path.getsize(filename)
+        except OSError as e:
+            # Broken links and files removed since the directory was listed
+            print('Skipping file that cannot be read: ', filename, e)
+            return False
+
         if file_size > self.max_file_size:
             if self.show_warning_size_skip:
                 self.warnings.append(
@@ -80,3 +244,64 @@ class DirScanner:
 
     def _should_include_dir(self, directory):
         return directory.lower() not in self.dirs_to_ignore
+
+
+class FileMatcher:
+    """
+    Find the lines of a file that contain any of the search terms.
+    """
+    def __init__(self, settings, target_string):
+        self.search_terms = [x.lower() for x in target_string.split()]
+        self.max_line_len = settings.get('find_in_project_max_line_len', 100)
+
+        self.scanner = FileScanner(settings, get_line_cache(settings))
+
+    def search_file(self, path):
+        """Search a file for the search terms."""
+
+        ret = collections.OrderedDict()
+        for line_num, line_content in self.scanner.read_lines(path):
+            # Search line for target string
+            loc = self._line_matches(line_content, self.search_terms)
+            if loc >= 0:
+                if len(line_content) > self.max_line_len:
+                    line_content = self._limit_line(line_content, loc)
+                ret[line_num] = line_content
+
+        if self.scanner.warnings:
+            ret[0] = self.scanner.warnings[0]
+
+        return ret
+
+    def _line_matches(self, line, terms):
+        lower_line = line.lower()
+        for term in terms:
+            location = lower_line.find(term)
+            if location >= 0:
+                return location
+
+        return -1
+
+    def _limit_line(self, line, loc):
+        """
+        Limit the provided line according to the settings.
+        """
+        single_side_len = int(self.max_line_len/2)
+
+        start = loc - single_side_len
+        if start < 0:
+            start = 0
+
+        end = loc + single_side_len
+        if (end >= len(line)):
+            end = len(line)-1
+
+        limited_line = ""
+        if start != 0:
+            limited_line = limited_line + "[…]"
+
+        limited_line = limited_line + line[start:end]
+        if end != len(line)-1:
+            limited_line = limited_line + "[…]"
+
+        return limited_line
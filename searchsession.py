@@ -0,0 +1,135 @@
+import concurrent.futures
+import itertools
+import queue
+import threading
+import time
+
+
+class SearchSession:
+    """State of a single search.
+
+    * Identified by a session id
+    * Owns the result queue the searcher fills and the search counters
+    * Cancelled when a newer search in the same window supersedes it
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.result_queue = queue.Queue()
+        self.searcher = None
+        self.future = None
+        self.result_buffer = None
+
+        self.num_hits = 0
+        self.num_file_hits = 0
+        self.last_status_update = 0
+        self.search_cancelled = False
+        self.search_partial = False
+        self.files_searched = 0
+        self.files_to_search = 0
+        self.cache_hits = 0
+        self.index_coverage = 1.0
+        self.rank_timed_out = False
+        self.search_start_time = time.time()
+
+        self._superseded = threading.Event()
+
+    def is_superseded(self):
+        return self._superseded.is_set()
+
+    def is_running(self):
+        return self.future is not None and not self.future.done()
+
+    def has_results(self):
+        return not self.result_queue.empty()
+
+    def stop(self):
+        """Stop the searcher, keeping the results found so far"""
+        if self.searcher is not None:
+            self.searcher.stop()
+
+    def supersede(self):
+        """Stop the search and discard its pending results"""
+        self._superseded.set()
+        self.stop()
+        self.drain()
+
+    def drain(self):
+        while True:
+            try:
+                self.result_queue.get_nowait()
+            except queue.Empty:
+                return
+            self.result_queue.task_done()
+
+
+class SearchSessionManager:
+    """Run searches on a persistent, shared pool of search threads.
+
+    Keeps the current session per key (window). Starting a new session
+    supersedes the previous one, which is stopped and drained so its thread
+    returns to the pool promptly.
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._session_ids = itertools.count(1)
+        self._sessions = {}
+
+    def begin(self, key):
+        """Create the session for a new search, superseding the current one"""
+        with self._lock:
+            session = SearchSession(next(self._session_ids))
+            previous = self._sessions.get(key)
+            self._sessions[key] = session
+
+        if previous is not None:
+            print("Superseding search session", previous.session_id)
+            previous.supersede()
+
+        return session
+
+    def run(self, session, searcher):
+        """Run the searcher of a session on the pool"""
+        session.searcher = searcher
+        if session.is_superseded():
+            return
+
+        session.future = self._executor.submit(searcher.run)
+
+    def end(self, key, session):
+        with self._lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+
+    def shutdown(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for session in sessions:
+            session.supersede()
+        self._executor.shutdown(wait=False)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager(max_workers=2):
+    global _manager
+
+    with _manager_lock:
+        if _manager is None:
+            _manager = SearchSessionManager(max_workers)
+        return _manager
+
+
+def shutdown():
+    global _manager
+
+    with _manager_lock:
+        if _manager is not None:
+            _manager.shutdown()
+            _manager = None
@@ -0,0 +1,228 @@
+import array
+import bisect
+import heapq
+import sys
+
+# Terms per block of the block frequency maxima, which let prefix lookups
+# skip the blocks that cannot hold one of the most frequent terms
+BLOCK_SIZE = 64
+
+# Misspellings more than one edit away must share this many leading
+# characters, which bounds the dictionary walk on large vocabularies
+WIDE_FUZZY_PREFIX_LENGTH = 2
+
+
+def auto_edit_distance(term, max_distance):
+    """Edit distance allowed for a term - short terms must match closely."""
+    if len(term) < 3:
+        return 0
+    if len(term) < 6:
+        return min(1, max_distance)
+    return min(2, max_distance)
+
+
+def _prefix_end(prefix):
+    """Smallest string sorting after every string starting with prefix."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class TermDictionary:
+    """Sorted term dictionary with document frequencies.
+
+    Supports prefix lookup by binary search and bounded edit distance lookup
+    by walking the sorted terms as an implicit trie, sharing the Levenshtein
+    rows of common prefixes and skipping every term under a prefix that is
+    already too far from the searched term. Once a prefix has used up all
+    edits only the exact remainders of the searched term are looked up.
+    """
+
+    def __init__(self, document_frequencies):
+        entries = sorted(document_frequencies.items())
+        self._terms = [term for term, _ in entries]
+        self._frequencies = [frequency for _, frequency in entries]
+        self._block_maxima = self._compute_block_maxima()
+
+    @classmethod
+    def from_sorted(cls, terms, frequencies):
+        """Dictionary over sequences already sorted by term.
+
+        The sequences only need to support len, indexing and slicing, so the
+        terms can be read from a mapped index instead of being held in memory.
+        """
+        term_dictionary = cls({})
+        term_dictionary._terms = terms
+        term_dictionary._frequencies = frequencies
+        term_dictionary._block_maxima = term_dictionary._compute_block_maxima()
+        return term_dictionary
+
+    def _compute_block_maxima(self):
+        frequencies = self._frequencies
+        return array.array('i', (max(frequencies[start:start + BLOCK_SIZE])
+                                 for start in range(0, len(frequencies), BLOCK_SIZE)))
+
+    def __len__(self):
+        return len(self._terms)
+
+    def memory_usage(self):
+        """Estimated bytes held by the dictionary"""
+        size = sys.getsizeof(self._terms) + sys.getsizeof(self._frequencies) + sys.getsizeof(self._block_maxima)
+        if isinstance(self._terms, list):
+            for term, frequency in zip(self._terms, self._frequencies):
+                size += sys.getsizeof(term) + sys.getsizeof(frequency)
+
+        return size
+
+    def prefix(self, prefix, limit=10):
+        """Most frequent terms starting with prefix as (term, doc frequency)."""
+        if not prefix or limit <= 0:
+            return []
+
+        start = bisect.bisect_left(self._terms, prefix)
+        end = bisect.bisect_left(self._terms, _prefix_end(prefix), start)
+        return [(self._terms[index], frequency) for index, frequency in self._most_frequent(start, end, limit)]
+
+    def _most_frequent(self, start, end, limit):
+        """The limit most frequent terms in [start, end) as (index, doc frequency).
+
+        Whole blocks are visited in order of their maximum and the rest are
+        skipped once the limit most frequent terms seen outnumber them, so
+        short prefixes covering much of the dictionary stay cheap.
+        """
+        frequencies = self._frequencies
+        first_block = -(-start // BLOCK_SIZE)
+        last_block = end // BLOCK_SIZE
+        if first_block >= last_block:
+            return heapq.nlargest(limit, zip(range(start, end), frequencies[start:end]), key=lambda x: x[1])
+
+        # The partial blocks at both ends are always searched
+        candidates = list(zip(range(start, first_block * BLOCK_SIZE),
+                              frequencies[start:first_block * BLOCK_SIZE]))
+        candidates.extend(zip(range(last_block * BLOCK_SIZE, end), frequencies[last_block * BLOCK_SIZE:end]))
+        top = heapq.nlargest(limit, (frequency for _, frequency in candidates))
+        heapq.heapify(top)
+
+        blocks = [(-self._block_maxima[block], block) for block in range(first_block, last_block)]
+        heapq.heapify(blocks)
+        while blocks and (len(top) < limit or top[0] < -blocks[0][0]):
+            block = heapq.heappop(blocks)[1]
+            block_start = block * BLOCK_SIZE
+            for index, frequency in zip(range(block_start, block_start + BLOCK_SIZE),
+                                        frequencies[block_start:block_start + BLOCK_SIZE]):
+                candidates.append((index, frequency))
+                if len(top) < limit:
+                    heapq.heappush(top, frequency)
+                elif frequency > top[0]:
+                    heapq.heapreplace(top, frequency)
+
+        candidates.sort()
+        return heapq.nlargest(limit, candidates, key=lambda x: x[1])
+
+    def fuzzy(self, term, max_distance=1, limit=10, prefix_length=0):
+        """Terms within max_distance edits of term as (term, doc frequency, distance).
+
+        If prefix_length is set only terms sharing the first prefix_length
+        characters are considered, which keeps the walk away from the dense
+        top of the dictionary. Closest terms come first, ties broken by doc
+        frequency and then by term.
+        """
+        matches = []
+        terms = self._terms
+        width = len(term) + 1
+
+        start = 0
+        end = len(terms)
+        if prefix_length and len(term) >= prefix_length:
+            start = bisect.bisect_left(terms, term[:prefix_length])
+            end = bisect.bisect_left(terms, _prefix_end(term[:prefix_length]), start)
+
+        # rows[k] is the Levenshtein row for the first k characters of the
+        # current dictionary term. Only the band of cells within max_distance
+        # of the diagonal can stay within the distance, the other cells are
+        # capped at max_distance + 1.
+        cap = max_distance + 1
+        rows = [[min(col, cap) for col in range(width)]]
+        previous = ''
+        index = start
+        while index < end:
+            candidate = terms[index]
+
+            # Reuse the rows of the prefix shared with the previous term
+            common = 0
+            common_limit = min(len(candidate), len(previous), len(rows) - 1)
+            while common < common_limit and candidate[common] == previous[common]:
+                common += 1
+            del rows[common + 1:]
+
+            pruned = False
+            for depth in range(common + 1, len(candidate) + 1):
+                char = candidate[depth - 1]
+                above = rows[-1]
+                row = [cap] * width
+                row[0] = row_min = depth if depth < cap else cap
+                band_start = max(1, depth - max_distance)
+                band_end = min(width, depth + max_distance + 1)
+                for col in range(band_start, band_end):
+                    value = above[col - 1] if term[col - 1] == char else above[col - 1] + 1
+                    if above[col] + 1 < value:
+                        value = above[col] + 1
+                    if row[col - 1] + 1 < value:
+                        value = row[col - 1] + 1
+                    if value < cap:
+                        row[col] = value
+                        if value < row_min:
+                            row_min = value
+                rows.append(row)
+
+                if row_min >= max_distance:
+                    previous = candidate[:depth]
+                    subtree_end = bisect.bisect_left(terms, _prefix_end(previous), index + 1, end)
+                    if row_min == max_distance:
+                        # The edits are used up, so a term under this prefix
+                        # matches only if the rest of the searched term
+                        # follows a cell at the distance - look those up
+                        # instead of walking the subtree
+                        for col in range(max(0, depth - max_distance), min(width, depth + max_distance + 1)):
+                            if row[col] == max_distance:
+                                target = previous + term[col:]
+                                found = bisect.bisect_left(terms, target, index, subtree_end)
+                                if found < subtree_end and terms[found] == target:
+                                    matches.append((target, self._frequencies[found], max_distance))
+                    # Otherwise no term under this prefix can match
+                    index = subtree_end
+                    pruned = True
+                    break
+
+            if pruned:
+                continue
+
+            distance = rows[-1][-1]
+            if distance <= max_distance:
+                matches.append((candidate, self._frequencies[index], distance))
+
+            previous = candidate
+            index += 1
+
+        matches.sort(key=lambda x: (x[2], -x[1], x[0]))
+        return matches[:limit]
+
+    def suggest(self, term, max_distance=2, limit=10):
+        """Completions for a partially typed term as (term, doc frequency).
+
+        Prefix matches come first, followed by close misspellings. Terms two
+        edits away must share the first WIDE_FUZZY_PREFIX_LENGTH characters.
+        """
+        suggestions = self.prefix(term, limit)
+        seen = set(candidate for candidate, _ in suggestions)
+        for distance in range(1, auto_edit_distance(term, max_distance) + 1):
+            if len(suggestions) >= limit:
+                break
+
+            # All closer matches are among the suggestions already, so this
+            # many leaves room for the new ones
+            prefix_length = 0 if distance == 1 else WIDE_FUZZY_PREFIX_LENGTH
+            for candidate, frequency, _ in self.fuzzy(term, distance, limit + len(suggestions), prefix_length):
+                if candidate not in seen and len(suggestions) < limit:
+                    seen.add(candidate)
+                    suggestions.append((candidate, frequency))
+
+        return suggestions
@@ -0,0 +1,19 @@
+import os
+import sys
+import types
+
+PACKAGE_NAME = 'FindInProject'
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_package():
+    """
+    Register the plugin folder as the FindInProject package so the modules
+    that do not need the Sublime API can be imported outside the editor.
+    """
+    if PACKAGE_NAME not in sys.modules:
+        package = types.ModuleType(PACKAGE_NAME)
+        package.__path__ = [PACKAGE_DIR]
+        sys.modules[PACKAGE_NAME] = package
+
+    return sys.modules[PACKAGE_NAME]
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import load_package
+
+load_package()
+
+from FindInProject import scanners  # noqa: E402
+
+
+class LineCacheTest(unittest.TestCase):
+    def test_changed_stamp_drops_entry(self):
+        line_cache = scanners.LineCache(1000)
+        generation = line_cache.new_generation()
+        line_cache.put("/project/a.txt", (10, 1), [(1, "alpha")], 100, generation)
+
+        self.assertEqual([(1, "alpha")], line_cache.get("/project/a.txt", (10, 1), generation))
+        self.assertIsNone(line_cache.get("/project/a.txt", (10, 2), generation))
+        self.assertEqual(0, line_cache.size)
+
+        # The stale entry is gone for the old stamp too
+        self.assertIsNone(line_cache.get("/project/a.txt", (10, 1), generation))
+
+    def test_search_never_evicts_its_own_files(self):
+        line_cache = scanners.LineCache(300)
+        generation = line_cache.new_generation()
+        line_cache.put("a", 0, ["a"], 100, generation)
+        line_cache.put("b", 0, ["b"], 100, generation)
+        line_cache.put("c", 0, ["c"], 100, generation)
+
+        # Full - the same search keeps the files it read first
+        line_cache.put("d", 0, ["d"], 100, generation)
+        self.assertIsNone(line_cache.get("d", 0, generation))
+        self.assertEqual(300, line_cache.size)
+
+        # A later search evicts the least recently used files of earlier
+        # ones, files it has read itself stay
+        generation = line_cache.new_generation()
+        self.assertEqual(["b"], line_cache.get("b", 0, generation))
+        line_cache.put("d", 0, ["d"], 100, generation)
+        line_cache.put("e", 0, ["e"], 100, generation)
+        self.assertIsNone(line_cache.get("a", 0, generation))
+        self.assertIsNone(line_cache.get("c", 0, generation))
+        self.assertEqual(["b"], line_cache.get("b", 0, generation))
+        self.assertEqual(["d"], line_cache.get("d", 0, generation))
+        self.assertEqual(["e"], line_cache.get("e", 0, generation))
+
+        line_cache.put("f", 0, ["f"], 100, generation)
+        self.assertIsNone(line_cache.get("f", 0, generation))
+
+    def test_resize_evicts_oldest(self):
+        line_cache = scanners.LineCache(300)
+        generation = line_cache.new_generation()
+        for path in ("a", "b", "c"):
+            line_cache.put(path, 0, [path], 100, generation)
+
+        line_cache.resize(150)
+        self.assertEqual(100, line_cache.size)
+        self.assertIsNone(line_cache.get("b", 0, generation))
+        self.assertEqual(["c"], line_cache.get("c", 0, generation))
+
+    def test_hit_rate(self):
+        line_cache = scanners.LineCache(1000)
+        self.assertEqual(0.0, line_cache.hit_rate())
+
+        generation = line_cache.new_generation()
+        self.assertIsNone(line_cache.get("a", 0, generation))
+        line_cache.put("a", 0, ["a"], 10, generation)
+        line_cache.get("a", 0, generation)
+        line_cache.get("a", 0, generation)
+        line_cache.get("a", 1, generation)
+
+        self.assertEqual(2, line_cache.hits)
+        self.assertEqual(2, line_cache.misses)
+        self.assertEqual(0.5, line_cache.hit_rate())
+
+    def test_disabled_by_settings(self):
+        self.assertIsNone(scanners.get_line_cache({'find_in_project_line_cache_mb': 0}))
+
+
+class FileScannerCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.line_cache = scanners.LineCache(100000)
+        self.settings = {'find_in_project_show_warning_on_binary_skip': True}
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def read_lines(self, path):
+        scanner = scanners.FileScanner(self.settings, self.line_cache)
+        return list(scanner.read_lines(path)), scanner
+
+    def test_repeated_read_is_served_from_cache(self):
+        path = self.write_file("a.txt", "alpha\nbeta\n")
+
+        lines, scanner = self.read_lines(path)
+        self.assertEqual([(1, "alpha\n"), (2, "beta\n")], lines)
+        self.assertEqual(0, scanner.cache_hits)
+
+        cached_lines, scanner = self.read_lines(path)
+        self.assertEqual(lines, cached_lines)
+        self.assertEqual(1, scanner.cache_hits)
+        self.assertEqual(1, self.line_cache.hits)
+        self.assertEqual(1, self.line_cache.misses)
+
+    def test_changed_file_is_read_again(self):
+        path = self.write_file("a.txt", "alpha\n")
+        self.read_lines(path)
+
+        # Same size, later modification time
+        self.write_file("a.txt", "gamma\n")
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        lines, scanner = self.read_lines(path)
+        self.assertEqual([(1, "gamma\n")], lines)
+        self.assertEqual(0, scanner.cache_hits)
+
+        # Different size
+        self.write_file("a.txt", "gamma\ndelta\n")
+        lines, scanner = self.read_lines(path)
+        self.assertEqual([(1, "gamma\n"), (2, "delta\n")], lines)
+        self.assertEqual(0, scanner.cache_hits)
+
+    def test_oversize_file_is_not_cached(self):
+        self.line_cache = scanners.LineCache(4000)
+        path = self.write_file("large.txt", "line\n" * 100)
+
+        lines, _ = self.read_lines(path)
+        self.assertEqual(100, len(lines))
+        self.assertEqual(0, self.line_cache.size)
+
+        lines, scanner = self.read_lines(path)
+        self.assertEqual(100, len(lines))
+        self.assertEqual(0, scanner.cache_hits)
+
+    def test_file_with_warnings_is_not_cached(self):
+        path = self.write_file("binary.dat", "header\n\0\0\0\n")
+
+        _, scanner = self.read_lines(path)
+        self.assertEqual(1, len(scanner.warnings))
+        self.assertEqual(0, self.line_cache.size)
+
+        _, scanner = self.read_lines(path)
+        self.assertEqual(0, scanner.cache_hits)
+
+    def test_without_cache(self):
+        path = self.write_file("a.txt", "alpha\n")
+        scanner = scanners.FileScanner(self.settings)
+        self.assertEqual([(1, "alpha\n")], list(scanner.read_lines(path)))
+        self.assertIsNone(scanner.cache_generation)
+
+
+if __name__ == '__main__':
+    unittest.main()
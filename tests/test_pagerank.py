@@ -0,0 +1,129 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tests import load_package
+
+load_package()
+
+from FindInProject import pagerank  # noqa: E402
+
+
+def build_graph(link_count=400, node_count=60, seed=1):
+    rand = random.Random(seed)
+    graph = pagerank.Graph()
+    links = []
+    for node_index in range(node_count):
+        graph.add_node("page%i" % node_index).filename = "/project/page%i.txt" % node_index
+    for _ in range(link_count):
+        source, target = rand.randrange(node_count), rand.randrange(node_count)
+        graph.add_link("page%i" % source, "page%i" % target)
+        links.append((source, target))
+
+    return graph, links
+
+
+class GraphTest(unittest.TestCase):
+    def assertLinks(self, graph, links):
+        expected = set((source, target) for source, target in links if source != target)
+        for index in range(len(graph)):
+            self.assertEqual(sorted(target for source, target in expected if source == index),
+                             list(graph.out_links(index)))
+            self.assertEqual(sorted(source for source, target in expected if target == index),
+                             list(graph.in_links(index)))
+            self.assertEqual(len(graph.out_links(index)), graph.out_count(index))
+
+    def test_finalize_sorts_and_deduplicates(self):
+        graph, links = build_graph()
+        self.assertLinks(graph, links)
+
+    def test_add_after_finalize(self):
+        graph, links = build_graph()
+        graph.finalize()
+
+        graph.add_link("page1", "new")
+        graph.add_link("page2", "page3")
+        new_index = graph.get_node_by_id("new").index
+        self.assertLinks(graph, links + [(1, new_index), (2, 3)])
+
+    def test_save_load_round_trip(self):
+        graph, links = build_graph()
+        graph.add_node("ünïcode")
+        graph.add_link("page0", "ünïcode")
+        links.append((0, graph.get_node_by_id("ünïcode").index))
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "links.graph")
+            graph.save(path)
+            loaded = pagerank.Graph.load(path)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(len(graph), len(loaded))
+        for index in range(len(graph)):
+            self.assertEqual(graph[index].node_id, loaded[index].node_id)
+            self.assertEqual(getattr(graph[index], 'filename', None), getattr(loaded[index], 'filename', None))
+        self.assertLinks(loaded, links)
+
+    def test_empty_graph_round_trip(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "empty.graph")
+            pagerank.Graph().save(path)
+            self.assertEqual(0, len(pagerank.Graph.load(path)))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_rejects_truncated_file(self):
+        graph = build_graph()[0]
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "links.graph")
+            graph.save(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            for length in (8, 40, len(data) // 2, len(data) - 1):
+                with open(path, 'wb') as f:
+                    f.write(data[:length])
+                self.assertRaises(ValueError, pagerank.Graph.load, path)
+        finally:
+            shutil.rmtree(directory)
+
+
+class PageRankTest(unittest.TestCase):
+    def test_ranks_converge_to_a_distribution(self):
+        graph, _ = build_graph()
+        page_ranks, iteration_count = pagerank.PageRank(graph).calculate()
+
+        self.assertAlmostEqual(1.0, sum(rank for _, rank in page_ranks), places=4)
+        self.assertGreater(iteration_count, 2)
+        self.assertEqual(sorted(page_ranks, key=lambda x: -x[1]), page_ranks)
+
+    def test_linked_page_ranks_highest(self):
+        graph = pagerank.Graph()
+        graph.add_links([("a", "hub"), ("b", "hub"), ("c", "hub"), ("hub", "a")])
+        page_ranks, _ = pagerank.PageRank(graph).calculate()
+        self.assertEqual("hub", page_ranks[0][0])
+
+    def test_personalized_ranks_favour_seeds(self):
+        graph, _ = build_graph()
+        page_ranks, push_count = pagerank.PersonalizedPageRank(graph).calculate({"page7": 1.0})
+
+        self.assertGreater(push_count, 0)
+        self.assertEqual("page7", page_ranks[0][0])
+
+    def test_file_ranks(self):
+        graph = pagerank.Graph()
+        graph.add_node("a").filename = "/project/a.txt"
+        graph.add_link("a", "missing")
+        rank_mappings, sum_ranks = pagerank.file_ranks(graph, [("a", 0.6), ("missing", 0.4)])
+        self.assertEqual({"/project/a.txt": 0.6}, rank_mappings)
+        self.assertAlmostEqual(0.6, sum_ranks)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import load_package
+
+load_package()
+
+from FindInProject import postings  # noqa: E402
+from FindInProject import tfidf_search  # noqa: E402
+
+
+DOCUMENTS = [
+    ("/project/alpha.txt", ["alpha", "beta", "beta", "gamma"]),
+    ("/project/beta.txt", ["beta", "delta", "délta", "ωμέγα"]),
+    ("/project/gamma.txt", ["gamma"] * 200 + ["alpha"]),
+    ("/project/empty.txt", []),
+    ("/project/ünïcode.txt", ["日本語", "alpha", "ωμέγα", "ωμέγα"]),
+]
+
+SEARCHES = ["alpha", "beta gamma", "délta", "ωμέγα 日本語", "alpha alpha beta", "missing", "ALPHA"]
+
+
+class MappedTfIdfTableTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "index.idx")
+
+        self.idf_table = tfidf_search.TfIdfTable()
+        for doc_name, terms in DOCUMENTS:
+            self.idf_table.append_document(doc_name, terms)
+
+        postings.write_index(self.idf_table, self.path)
+        self.mapped_table = postings.MappedTfIdfTable(self.path)
+
+    def tearDown(self):
+        self.mapped_table.close()
+        shutil.rmtree(self.directory)
+
+    def assertSameScores(self, expected, actual):
+        self.assertEqual([name for name, _ in sorted(expected)], [name for name, _ in sorted(actual)])
+        for (_, expected_score), (_, actual_score) in zip(sorted(expected), sorted(actual)):
+            self.assertAlmostEqual(expected_score, actual_score)
+
+    def test_search_matches_in_memory_table(self):
+        for search in SEARCHES:
+            self.assertSameScores(self.idf_table.search(search), self.mapped_table.search(search))
+
+    def test_document_frequencies_round_trip(self):
+        self.assertEqual(self.idf_table.document_frequencies(), self.mapped_table.document_frequencies())
+        self.assertEqual(len(self.idf_table), len(self.mapped_table))
+
+    def test_sorted_terms(self):
+        doc_freqs = self.idf_table.document_frequencies()
+        terms = self.mapped_table.sorted_terms()
+        self.assertEqual(sorted(doc_freqs), terms[0:len(terms)])
+        self.assertEqual([doc_freqs[term] for term in sorted(doc_freqs)],
+                         self.mapped_table.sorted_document_frequencies()[0:len(terms)])
+
+    def test_empty_search(self):
+        self.assertEqual([], self.mapped_table.search(""))
+        self.assertEqual([], self.mapped_table.search("   "))
+
+    def test_empty_table(self):
+        path = os.path.join(self.directory, "empty.idx")
+        postings.write_index(tfidf_search.TfIdfTable(), path)
+        mapped_table = postings.MappedTfIdfTable(path)
+        try:
+            self.assertEqual(0, len(mapped_table))
+            self.assertEqual([], mapped_table.search("alpha"))
+            self.assertEqual({}, mapped_table.document_frequencies())
+        finally:
+            mapped_table.close()
+
+    def test_rejects_unknown_format(self):
+        path = os.path.join(self.directory, "bad.idx")
+        with open(path, 'wb') as f:
+            f.write(b'NOTANIDX' + bytes(64))
+
+        self.assertRaises(ValueError, postings.MappedTfIdfTable, path)
+
+    def test_rejects_truncated_file(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        path = os.path.join(self.directory, "truncated.idx")
+        for length in (8, len(data) // 2, len(data) - 1):
+            with open(path, 'wb') as f:
+                f.write(data[:length])
+            self.assertRaises(ValueError, postings.MappedTfIdfTable, path)
+
+    def test_large_counts_and_gaps(self):
+        # Postings deltas and counts spanning several varint bytes
+        idf_table = tfidf_search.TfIdfTable()
+        for doc_index in range(300):
+            terms = ["common"]
+            if doc_index % 150 == 0:
+                terms += ["rare"] * 70000
+            idf_table.append_document("/project/doc%i.txt" % doc_index, terms)
+
+        path = os.path.join(self.directory, "large.idx")
+        postings.write_index(idf_table, path)
+        mapped_table = postings.MappedTfIdfTable(path)
+        try:
+            for search in ("common", "rare", "rare common"):
+                self.assertSameScores(idf_table.search(search), mapped_table.search(search))
+        finally:
+            mapped_table.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from tests import load_package
+
+load_package()
+
+from FindInProject import matrix_search  # noqa: E402
+from FindInProject import postings  # noqa: E402
+from FindInProject import tfidf_search  # noqa: E402
+
+# Fixed test set of small notes, with the document expected to rank first for
+# each query under both scoring modes
+CORPUS = {
+    "python.txt": "python is a programming language python code is readable and python is popular",
+    "snakes.txt": "the python is a large snake snakes like the python and the boa live in forests",
+    "coffee.txt": "coffee beans are roasted and ground before brewing coffee with hot water",
+    "tea.txt": "tea leaves are steeped in hot water green tea and black tea differ in processing",
+    "brewing.txt": "brewing beer needs malt hops yeast and water brewing takes weeks",
+    "garden.txt": "the garden has roses tulips and a small pond with fish and a snake",
+    "language.txt": "a language has grammar and words programming language grammar is formal",
+    "forest.txt": "forests have trees moss snakes birds and forests cover large areas",
+    "long.txt": " ".join(["water"] * 3 + ["filler"] * 200 + ["tea"]),
+}
+
+EXPECTED_BEST = {
+    "python": "python.txt",
+    "coffee": "coffee.txt",
+    "tea": "tea.txt",
+    "brewing beer": "brewing.txt",
+    "programming language": "language.txt",
+    "snakes forests": "forest.txt",
+}
+
+
+def build_table(scoring):
+    idf_table = tfidf_search.TfIdfTable(scoring)
+    for name in sorted(CORPUS):
+        idf_table.append_document(name, CORPUS[name].split())
+    return idf_table
+
+
+def ranking(term_scores):
+    return [name for name, _ in sorted(term_scores, key=lambda x: (-x[1], x[0]))]
+
+
+class ScoringTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def mapped_table(self, idf_table, scoring):
+        path = os.path.join(self.directory, "%s.idx" % scoring)
+        postings.write_index(idf_table, path)
+        mapped_table = postings.MappedTfIdfTable(path, scoring)
+        self.addCleanup(mapped_table.close)
+        return mapped_table
+
+    def assertSameScores(self, expected, actual):
+        self.assertEqual(ranking(expected), ranking(actual))
+        expected, actual = dict(expected), dict(actual)
+        for name in expected:
+            self.assertAlmostEqual(expected[name], actual[name])
+
+    def test_both_modes_rank_fixed_test_set(self):
+        for scoring in tfidf_search.SCORING_MODES:
+            idf_table = build_table(scoring)
+            for search, best in EXPECTED_BEST.items():
+                self.assertEqual(best, ranking(idf_table.search(search))[0], (scoring, search))
+
+    def test_bm25_normalises_document_length(self):
+        # tf-idf favours the long document repeating "water", BM25 the short ones
+        tfidf_ranking = ranking(build_table(tfidf_search.SCORING_TFIDF).search("hot water"))
+        bm25_ranking = ranking(build_table(tfidf_search.SCORING_BM25).search("hot water"))
+        self.assertEqual(set(tfidf_ranking), set(bm25_ranking))
+        self.assertNotEqual("long.txt", bm25_ranking[0])
+
+    def test_mapped_table_scores_like_table(self):
+        for scoring in tfidf_search.SCORING_MODES:
+            idf_table = build_table(scoring)
+            mapped_table = self.mapped_table(idf_table, scoring)
+            for search in list(EXPECTED_BEST) + ["hot water", "missing"]:
+                self.assertSameScores(idf_table.search(search), mapped_table.search(search))
+
+    @unittest.skipUnless(matrix_search.is_available(), "NumPy is not available")
+    def test_matrix_scores_like_table(self):
+        for scoring in tfidf_search.SCORING_MODES:
+            idf_table = build_table(scoring)
+            matrix_table = matrix_search.MatrixSearchTable(idf_table, scoring)
+            for search in list(EXPECTED_BEST) + ["hot water", "missing"]:
+                self.assertSameScores(idf_table.search(search), matrix_table.search(search))
+
+    @unittest.skipUnless(matrix_search.is_available(), "NumPy is not available")
+    def test_evicted_matrix_keeps_scores(self):
+        # Evicting the matrix to the mapped index must not change the ranking
+        for scoring in tfidf_search.SCORING_MODES:
+            idf_table = build_table(scoring)
+            matrix_table = matrix_search.MatrixSearchTable(idf_table, scoring)
+            mapped_table = self.mapped_table(idf_table, scoring)
+            self.assertEqual(matrix_table.scoring, mapped_table.scoring)
+            for search in list(EXPECTED_BEST) + ["hot water"]:
+                self.assertSameScores(matrix_table.search(search), mapped_table.search(search))
+
+    def test_unknown_scoring_mode(self):
+        self.assertRaises(ValueError, tfidf_search.TfIdfTable, "BM25")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from tests import load_package
+
+load_package()
+
+from FindInProject import postings  # noqa: E402
+from FindInProject import termdict  # noqa: E402
+from FindInProject import tfidf_search  # noqa: E402
+
+
+def levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def random_vocabulary(rand, alphabet, count, max_length=7):
+    document_frequencies = {}
+    for _ in range(count):
+        term = "".join(rand.choice(alphabet) for _ in range(rand.randint(1, max_length)))
+        document_frequencies[term] = rand.randint(1, 20)
+    return document_frequencies
+
+
+class TermDictionaryTest(unittest.TestCase):
+    def test_fuzzy_matches_brute_force(self):
+        rand = random.Random(3)
+        for _ in range(20):
+            alphabet = "abcdé"[:rand.randint(2, 5)]
+            document_frequencies = random_vocabulary(rand, alphabet, rand.randint(0, 300))
+            term_dictionary = termdict.TermDictionary(document_frequencies)
+            for _ in range(15):
+                term = "".join(rand.choice(alphabet) for _ in range(rand.randint(0, 7)))
+                for max_distance in (0, 1, 2, 3):
+                    for prefix_length in (0, 1, 2):
+                        expected = sorted(
+                            (candidate, frequency, levenshtein(candidate, term))
+                            for candidate, frequency in document_frequencies.items()
+                            if levenshtein(candidate, term) <= max_distance and
+                            (len(term) < prefix_length or candidate.startswith(term[:prefix_length])))
+                        actual = term_dictionary.fuzzy(term, max_distance, len(document_frequencies), prefix_length)
+                        self.assertEqual(expected, sorted(actual), (term, max_distance, prefix_length))
+
+    def test_fuzzy_orders_by_distance_then_frequency(self):
+        term_dictionary = termdict.TermDictionary({"test": 1, "tent": 5, "text": 9, "toast": 20, "tests": 2})
+        self.assertEqual([("test", 1, 0), ("text", 9, 1), ("tent", 5, 1), ("tests", 2, 1), ("toast", 20, 2)],
+                         term_dictionary.fuzzy("test", 2))
+        self.assertEqual([("test", 1, 0), ("text", 9, 1)], term_dictionary.fuzzy("test", 2, 2))
+
+    def test_prefix_matches_brute_force(self):
+        rand = random.Random(5)
+        for count in (0, 10, termdict.BLOCK_SIZE, termdict.BLOCK_SIZE + 1, 1000):
+            document_frequencies = random_vocabulary(rand, "abcd", count, 6)
+            term_dictionary = termdict.TermDictionary(document_frequencies)
+            for prefix in ("a", "ab", "b", "cd", "abc", "x"):
+                for limit in (0, 1, 3, 8, 2000):
+                    matching = [(term, frequency) for term, frequency in document_frequencies.items()
+                                if term.startswith(prefix)]
+                    expected = sorted(frequency for _, frequency in matching)[::-1][:limit]
+                    actual = term_dictionary.prefix(prefix, limit)
+                    self.assertEqual(expected, [frequency for _, frequency in actual], (prefix, limit))
+                    self.assertTrue(set(actual) <= set(matching))
+
+    def test_empty_prefix(self):
+        self.assertEqual([], termdict.TermDictionary({"alpha": 1}).prefix(""))
+
+    def test_suggest_orders_prefix_matches_first(self):
+        term_dictionary = termdict.TermDictionary({
+            "search": 10, "saerch": 30, "starch": 50, "seerch": 1, "seerches": 5, "sewrch": 2, "xeerch": 6,
+            "seer": 8, "serene": 60})
+
+        # Completions by frequency, then one edit away by frequency, then two
+        # edits away sharing the first characters - "starch" is left out
+        self.assertEqual([("seerches", 5), ("seerch", 1), ("saerch", 30), ("search", 10), ("xeerch", 6),
+                          ("sewrch", 2), ("seer", 8)],
+                         term_dictionary.suggest("seerch", 2, 10))
+        self.assertEqual([("seerches", 5), ("seerch", 1), ("saerch", 30), ("search", 10)],
+                         term_dictionary.suggest("seerch", 2, 4))
+        self.assertEqual([("seerches", 5), ("seerch", 1), ("saerch", 30), ("search", 10), ("xeerch", 6),
+                          ("sewrch", 2)],
+                         term_dictionary.suggest("seerch", 1, 10))
+
+        # Short terms are only completed
+        self.assertEqual([("serene", 60), ("search", 10), ("seer", 8)], term_dictionary.suggest("se", 2, 3))
+        self.assertEqual([], term_dictionary.suggest("xy", 2, 3))
+
+    def test_from_sorted_over_mapped_index(self):
+        rand = random.Random(7)
+        idf_table = tfidf_search.TfIdfTable()
+        for doc_index in range(50):
+            idf_table.append_document("/project/doc%i.txt" % doc_index,
+                                      ["term%i" % rand.randrange(400) for _ in range(30)] + ["ünïcode"])
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "index.idx")
+            postings.write_index(idf_table, path)
+            mapped_table = postings.MappedTfIdfTable(path)
+            try:
+                mapped_dictionary = termdict.TermDictionary.from_sorted(
+                    mapped_table.sorted_terms(), mapped_table.sorted_document_frequencies())
+                term_dictionary = termdict.TermDictionary(idf_table.document_frequencies())
+
+                self.assertEqual(len(term_dictionary), len(mapped_dictionary))
+                for term in ("term1", "term12", "term3x", "ünï", "x"):
+                    self.assertEqual(term_dictionary.prefix(term, 5), mapped_dictionary.prefix(term, 5))
+                    self.assertEqual(term_dictionary.fuzzy(term, 1, 20), mapped_dictionary.fuzzy(term, 1, 20))
+                    self.assertEqual(term_dictionary.suggest(term, 2, 8), mapped_dictionary.suggest(term, 2, 8))
+            finally:
+                mapped_table.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_auto_edit_distance(self):
+        self.assertEqual(0, termdict.auto_edit_distance("ab", 2))
+        self.assertEqual(1, termdict.auto_edit_distance("abc", 2))
+        self.assertEqual(2, termdict.auto_edit_distance("abcdef", 2))
+        self.assertEqual(1, termdict.auto_edit_distance("abcdef", 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import time
+import unittest
+
+from tests import load_package
+
+load_package()
+
+from FindInProject import tfidf_search  # noqa: E402
+
+
+def build_table():
+    idf_table = tfidf_search.TfIdfTable()
+    for doc_index in range(2000):
+        terms = ["common"] * 5
+        if doc_index % 500 == 7:
+            terms.append("rare")
+        idf_table.append_document("/project/doc%i.txt" % doc_index, terms)
+
+    return idf_table
+
+
+class TfIdfTableTest(unittest.TestCase):
+    def test_scores(self):
+        idf_table = tfidf_search.TfIdfTable()
+        idf_table.append_document("a", ["alpha", "beta", "beta"])
+        idf_table.append_document("b", ["beta"])
+        idf_table.append_document("c", ["gamma"])
+
+        scores = dict(idf_table.search("alpha beta"))
+        self.assertEqual(["a", "b"], sorted(scores))
+        self.assertAlmostEqual((0.5 + 1 / 3.0) / 1.0 + (0.5 + 2 / 3.0) / 3.0, scores["a"])
+        self.assertAlmostEqual((0.5 + 1.0) / 3.0, scores["b"])
+        self.assertEqual(1.0, idf_table.last_coverage)
+
+    def test_expired_deadline_scores_rarest_term_first(self):
+        idf_table = build_table()
+
+        term_scores = idf_table.search("common rare", deadline=time.time() - 1.0)
+
+        # The first batch is always scored and it starts with the rare term
+        self.assertLess(idf_table.last_coverage, 1.0)
+        self.assertGreater(idf_table.last_coverage, 0.0)
+        scored = dict(term_scores)
+        for doc_index in range(7, 2000, 500):
+            self.assertIn("/project/doc%i.txt" % doc_index, scored)
+
+        best = max(term_scores, key=lambda x: x[1])[0]
+        self.assertEqual(best, max(idf_table.search("common rare"), key=lambda x: x[1])[0])
+
+    def test_document_frequencies(self):
+        idf_table = build_table()
+        self.assertEqual({"common": 2000, "rare": 4}, idf_table.document_frequencies())
+
+
+if __name__ == '__main__':
+    unittest.main()
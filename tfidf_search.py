@@ -1,60 +1,164 @@
+import array
+import math
+import sys
+import time
+
+# Number of postings scored between deadline checks. The first batch is
+# always scored so a search never comes back empty due to the deadline alone.
+DEADLINE_CHECK_INTERVAL = 256
+
+# Scoring modes supported by all search tables
+SCORING_TFIDF = 'tfidf'
+SCORING_BM25 = 'bm25'
+SCORING_MODES = (SCORING_TFIDF, SCORING_BM25)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def normalise_search(search):
+    """Split a search into terms and normalise their counts."""
+    search_terms = [x.lower() for x in search.split()]
+
+    # Count the search terms
+    search_term_counts = {}
+    for term in search_terms:
+        search_term_counts[term] = search_term_counts.get(term, 0.0) + 1.0
+
+    # Normalise search term counts
+    length = float(len(search_terms))
+    search_term_normals = {}
+    for term, count in search_term_counts.items():
+        search_term_normals[term] = count / length
+
+    return search_term_normals
+
+
+def check_scoring(scoring):
+    if scoring not in SCORING_MODES:
+        raise ValueError("Unknown scoring mode: %s" % scoring)
+
+
+def bm25_idf(doc_count, doc_freq):
+    return math.log(1.0 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def bm25_term_weight(count, doc_length, average_length, k1=BM25_K1, b=BM25_B):
+    """Saturated, length normalised weight of a term occurring count times in a document"""
+    length_norm = k1 * (1.0 - b + b * doc_length / max(average_length, 1.0))
+    return count * (k1 + 1.0) / (count + length_norm)
+
+
 class TfIdfTable:
-    def __init__(self):
+    def __init__(self, scoring=SCORING_TFIDF):
+        check_scoring(scoring)
+
         self.weighted = False
+        self.scoring = scoring
         self.documents = []
         self.overall_term_counts = {}
+        self.postings = {}
+        self.total_length = 0.0
+        self.last_coverage = 1.0
 
     def append_document(self, doc_name, list_of_terms):
         # Count terms in document
-        doc_term_counts = {} 
+        doc_term_counts = {}
         for term in list_of_terms:
             doc_term_counts[term] = doc_term_counts.get(term, 0.0) + 1.0
 
-        # Normalise doc term counts
-        length  = float(len(list_of_terms))
-        doc_term_normals = {}
-        for term, count in doc_term_counts.items():
-            doc_term_normals[term] = count / length
+        self.append_document_counts(doc_name, doc_term_counts, len(list_of_terms))
 
-        # Append overall term counts
-        for term in list_of_terms:
-            self.overall_term_counts[term] = self.overall_term_counts.get(term, 0.0) + 1.0
+    def append_document_counts(self, doc_name, doc_term_counts, length):
+        """Append a document whose terms have already been counted.
 
-        self.documents.append([doc_name, doc_term_normals])
+        Lets callers stream terms into a running counter instead of
+        collecting every term of a file in one list first.
+        """
+        # Append overall term counts and the document to the postings of its terms
+        doc_index = len(self.documents)
+        for term, count in doc_term_counts.items():
+            self.overall_term_counts[term] = self.overall_term_counts.get(term, 0.0) + count
+            term_postings = self.postings.get(term)
+            if term_postings is None:
+                term_postings = self.postings[term] = array.array('i')
+            term_postings.append(doc_index)
 
-    def search(self, search, threshold=0.0):
-        search_terms = [x.lower() for x in search.split()]
+        # Keep the raw counts and normalise against the length while searching
+        self.documents.append([doc_name, doc_term_counts, float(length)])
+        self.total_length += length
 
-        # Count the search terms
-        search_term_counts = {}
-        for term in search_terms:
-            search_term_counts[term] = search_term_counts.get(term, 0.0) + 1.0
+    def search(self, search, threshold=0.0, deadline=None):
+        """Score documents against the search.
 
-        # Normalise doc term counts
-        length = float(len(search_terms))
-        search_term_normals = {}
-        for term, count in search_term_counts.items():
-            search_term_normals[term] = count / length
+        Scores with tf-idf or BM25, as selected by scoring, term at a time
+        from the postings of the search terms, rarest term first. Rare terms
+        weigh the most, so if a deadline (as returned by time.time()) passes
+        the documents scored so far are the best matches. The fraction of
+        postings that were scored is kept in last_coverage.
+        """
+        search_term_normals = normalise_search(search)
 
         print("Searching index with", len(self.overall_term_counts), "terms for", search_term_normals)
 
+        terms = sorted((term for term in search_term_normals if term in self.postings),
+                       key=lambda term: self.overall_term_counts[term])
+        postings_total = sum(len(self.postings[term]) for term in terms)
+
+        doc_count = len(self.documents)
+        average_length = self.total_length / doc_count if doc_count else 0.0
+
         # Calculate term scores...
-        term_scores = []
-        for doc in self.documents:
-            score = 0.0
-            doc_term_counts = doc[1]
-            for term in search_term_normals:
-                if term in doc_term_counts:
-                    search_term_normal = search_term_normals[term]
-                    doc_term_normal = doc_term_counts[term]
-                    overall_term_count = self.overall_term_counts[term]
+        doc_scores = {}
+        postings_scored = 0
+        self.last_coverage = 1.0
+        for term in terms:
+            search_term_normal = search_term_normals[term]
+            overall_term_count = self.overall_term_counts[term]
+            idf = bm25_idf(doc_count, len(self.postings[term]))
+            for doc_index in self.postings[term]:
+                if deadline is not None and postings_scored and \
+                        postings_scored % DEADLINE_CHECK_INTERVAL == 0 and time.time() > deadline:
+                    self.last_coverage = postings_scored / float(postings_total)
+                    break
+
+                doc = self.documents[doc_index]
+                if self.scoring == SCORING_BM25:
+                    score = idf * bm25_term_weight(doc[1][term], doc[2], average_length) * search_term_normal
+                else:
+                    score = (search_term_normal + doc[1][term] / doc[2]) / overall_term_count
+                doc_scores[doc_index] = doc_scores.get(doc_index, 0.0) + score
+                postings_scored += 1
+
+            if self.last_coverage < 1.0:
+                print("Search deadline reached after scoring", postings_scored, "postings")
+                break
+
+        return [(self.documents[doc_index][0], score)
+                for doc_index, score in sorted(doc_scores.items())
+                if score > threshold]
 
-                    score += (search_term_normal + doc_term_normal) / overall_term_count
+    def document_frequencies(self):
+        """Number of documents containing each term"""
+        return dict((term, len(term_postings)) for term, term_postings in self.postings.items())
 
-            if score > threshold:
-                term_scores.append((doc[0], score))
+    def memory_usage(self):
+        """Estimated bytes held by the table.
+
+        Walks every document vector, so measure once per scan rather than
+        per search.
+        """
+        float_size = sys.getsizeof(0.0)
+        size = sys.getsizeof(self.documents) + sys.getsizeof(self.overall_term_counts) + sys.getsizeof(self.postings)
+        for term in self.overall_term_counts:
+            size += sys.getsizeof(term) + float_size + sys.getsizeof(self.postings[term])
+
+        for doc in self.documents:
+            size += sys.getsizeof(doc) + sys.getsizeof(doc[0]) + sys.getsizeof(doc[1]) + float_size
+            for term in doc[1]:
+                size += sys.getsizeof(term) + float_size
 
-        return  term_scores
+        return size
 
     def __len__(self):
         return len(self.documents)
@@ -0,0 +1,153 @@
+import json
+import struct
+import sys
+import threading
+import time
+import traceback
+
+from . import indexer
+from . import postings
+from . import scanners
+
+# Messages are JSON objects prefixed by their encoded length
+_LENGTH = struct.Struct('<I')
+
+# Search results are sent in batches of this many files, or sooner when the
+# batch interval (seconds) has passed
+RESULT_BATCH_FILES = 50
+RESULT_BATCH_INTERVAL = 0.1
+
+
+def write_message(stream, message):
+    data = json.dumps(message).encode('utf-8')
+    stream.write(_LENGTH.pack(len(data)) + data)
+    stream.flush()
+
+
+def read_message(stream):
+    """Read the next message, None when the stream is closed."""
+    header = _read_exactly(stream, _LENGTH.size)
+    if header is None:
+        return None
+
+    data = _read_exactly(stream, _LENGTH.unpack(header)[0])
+    if data is None:
+        return None
+
+    return json.loads(data.decode('utf-8'))
+
+
+def _read_exactly(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+
+    return data
+
+
+class Worker:
+    """
+    Serve scan and search requests read from the plugin, running each request
+    in its own thread so searches are not held up by a scan.
+    """
+    def __init__(self, output):
+        self._output = output
+        self._lock = threading.Lock()
+        self._cancelled = set()
+
+    def send(self, message):
+        with self._lock:
+            write_message(self._output, message)
+
+    def is_cancelled(self, request_id):
+        with self._lock:
+            return request_id in self._cancelled
+
+    def serve(self, stream):
+        while True:
+            message = read_message(stream)
+            if message is None:
+                return
+
+            if message.get("command") == "cancel":
+                with self._lock:
+                    self._cancelled.add(message["id"])
+                continue
+
+            thread = threading.Thread(target=self._handle, args=(message,))
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, message):
+        request_id = message.get("id")
+        try:
+            command = message.get("command")
+            if command == "scan":
+                self._scan(message)
+            elif command == "search":
+                self._search(message)
+            else:
+                self.send({"id": request_id, "error": "Unknown command: %s" % command})
+        except Exception:
+            traceback.print_exc()
+            self.send({"id": request_id, "error": traceback.format_exc()})
+        finally:
+            with self._lock:
+                self._cancelled.discard(request_id)
+
+    def _scan(self, message):
+        """Scan the project and store the index and graph for the plugin to map"""
+        project_indexer = indexer.ProjectIndexer(message["settings"])
+        idf_table, graph = project_indexer.scan(message["folders"])
+
+        postings.write_index(idf_table, message["index_path"])
+        graph.save(message["graph_path"])
+
+        self.send({"id": message["id"], "done": True, "documents": len(idf_table)})
+
+    def _search(self, message):
+        """Search the files in order and send the hits in batches"""
+        request_id = message["id"]
+        matcher = scanners.FileMatcher(message["settings"], message["target_string"])
+        deadline = message.get("deadline")
+
+        batch = []
+        files_searched = 0
+        timed_out = False
+        last_send = time.time()
+        for filepath in message["files"]:
+            if self.is_cancelled(request_id):
+                return
+
+            if deadline is not None and files_searched and time.time() > deadline:
+                timed_out = True
+                break
+
+            result = matcher.search_file(filepath)
+            files_searched += 1
+            if len(result):
+                batch.append([filepath, list(result.items())])
+
+            if len(batch) >= RESULT_BATCH_FILES or time.time() > last_send + RESULT_BATCH_INTERVAL:
+                self.send({"id": request_id, "results": batch, "files_searched": files_searched,
+                           "cache_hits": matcher.scanner.cache_hits})
+                batch = []
+                last_send = time.time()
+
+        self.send({"id": request_id, "results": batch, "files_searched": files_searched,
+                   "cache_hits": matcher.scanner.cache_hits, "timed_out": timed_out, "done": True})
+
+
+def main():
+    # Replies go out on the binary stdout, anything printed goes to stderr
+    output = sys.stdout.buffer
+    sys.stdout = sys.stderr
+
+    Worker(output).serve(sys.stdin.buffer)
+
+
+if __name__ == '__main__':
+    main()
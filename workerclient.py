@@ -0,0 +1,203 @@
+import os
+import queue
+import subprocess
+import threading
+
+import sublime
+
+from . import worker
+
+# Settings the worker needs to scan and search like the plugin does
+WORKER_SETTINGS = [
+    'find_in_project_encodings',
+    'find_in_project_skip_binary_files',
+    'find_in_project_ignore_dirs',
+    'find_in_project_ignore_extensions',
+    'find_in_project_max_file_size_mb',
+    'find_in_project_follow_sym_links',
+    'find_in_project_max_line_len',
+    'find_in_project_line_cache_mb',
+    'find_in_project_show_warning_on_open_failure',
+    'find_in_project_show_warning_on_size_skip',
+    'find_in_project_show_warning_on_binary_skip',
+    'find_in_project_page_ref_pattern',
+    'find_in_project_term_separator_pattern',
+]
+
+
+def worker_settings(settings):
+    """Copy the settings used by the worker into a plain dict"""
+    return dict((key, settings.get(key)) for key in WORKER_SETTINGS if settings.has(key))
+
+
+class WorkerClient:
+    """
+    Run the scan and search engines in a separate Python process so their work
+    does not hold the GIL of the plugin host.
+
+    Requests are sent over the stdin pipe of the worker and replies are read
+    from its stdout by a reader thread and handed out through a queue per
+    request.
+    """
+    def __init__(self, python_path):
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+
+        startupinfo = None
+        if os.name == 'nt':
+            # Do not pop up a console window
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+
+        self._process = subprocess.Popen([python_path, '-m', __package__ + '.worker'],
+                                         cwd=os.path.dirname(package_dir),
+                                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         startupinfo=startupinfo)
+
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._reply_queues = {}
+        self._exited = False
+        self.replied = False
+
+        for target in (self._read_replies, self._read_errors):
+            thread = threading.Thread(target=target, args=())
+            thread.daemon = True
+            thread.start()
+
+    def is_alive(self):
+        return self._process.poll() is None
+
+    def request(self, message):
+        """Send a request and return (request id, queue receiving its replies).
+
+        Raises OSError if the worker has exited.
+        """
+        reply_queue = queue.Queue()
+        with self._lock:
+            # Replies are no longer read, the queue would never be answered
+            if self._exited:
+                raise OSError("Worker process exited")
+
+            request_id = self._next_id
+            self._next_id += 1
+            self._reply_queues[request_id] = reply_queue
+
+            message = dict(message, id=request_id)
+            try:
+                worker.write_message(self._process.stdin, message)
+            except (OSError, ValueError) as e:
+                # Broken pipe, or stdin already closed
+                del self._reply_queues[request_id]
+                raise OSError("Unable to send request to worker: %s" % e)
+
+        return request_id, reply_queue
+
+    def wait_reply(self, request_id, reply_queue, timeout=1.0):
+        """Wait for the next reply to a request, an error reply if the worker exits"""
+        while True:
+            try:
+                return reply_queue.get(timeout=timeout)
+            except queue.Empty:
+                if not self.is_alive() and reply_queue.empty():
+                    with self._lock:
+                        self._reply_queues.pop(request_id, None)
+                    return {"id": request_id, "error": "Worker process exited"}
+
+    def cancel(self, request_id):
+        """Cancel a request and discard any further replies to it"""
+        with self._lock:
+            self._reply_queues.pop(request_id, None)
+            try:
+                worker.write_message(self._process.stdin, {"command": "cancel", "id": request_id})
+            except OSError:
+                pass
+
+    def finish(self, request_id):
+        with self._lock:
+            self._reply_queues.pop(request_id, None)
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+
+    def _read_replies(self):
+        while True:
+            try:
+                message = worker.read_message(self._process.stdout)
+            except (OSError, ValueError):
+                message = None
+
+            if message is None:
+                break
+
+            with self._lock:
+                self.replied = True
+                reply_queue = self._reply_queues.get(message.get("id"))
+            if reply_queue is not None:
+                reply_queue.put(message)
+
+        # Worker exited - fail all outstanding requests
+        with self._lock:
+            self._exited = True
+            for request_id, reply_queue in self._reply_queues.items():
+                reply_queue.put({"id": request_id, "error": "Worker process exited"})
+            self._reply_queues.clear()
+
+    def _read_errors(self):
+        for line in self._process.stderr:
+            print("FindInProject worker:", line.decode('utf-8', 'replace').rstrip())
+
+
+_client = None
+_client_lock = threading.Lock()
+
+# Worker Python that failed to start or exited before answering any request.
+# It is not started again until the setting changes or the plugin reloads.
+_failed_python_path = None
+
+
+def get_client():
+    """
+    Get the worker client, starting the worker process if needed. Returns None
+    if no worker Python is configured or the worker cannot be started, in
+    which case scanning and searching run in the plugin host.
+    """
+    global _client, _failed_python_path
+
+    settings = sublime.load_settings('FindInProject.sublime-settings')
+    python_path = settings.get('find_in_project_worker_python', "")
+    if not python_path or python_path == _failed_python_path:
+        return None
+
+    with _client_lock:
+        if _client is not None and not _client.is_alive():
+            if not _client.replied:
+                # Most likely the package cannot be imported by the worker,
+                # e.g. when installed as a zipped .sublime-package
+                print("Worker process exited on startup, scanning and searching in the plugin host")
+                _failed_python_path = python_path
+                _client = None
+                return None
+            _client = None
+
+        if _client is None:
+            try:
+                _client = WorkerClient(python_path)
+            except OSError as e:
+                print("Unable to start worker process:", e)
+                _failed_python_path = python_path
+                _client = None
+
+        return _client
+
+
+def shutdown():
+    global _client, _failed_python_path
+
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+        _failed_python_path = None